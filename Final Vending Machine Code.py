@@ -2,48 +2,152 @@
 
 import network
 import time
-from machine import Pin, PWM, I2C
+from machine import Pin, PWM, I2C, Timer
 import ssd1306
 
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+from vender import keypad as kp
+from vender.brokers import BrokerList
+from vender.collector import Collector
+from vender import journal as jr
+from vender.core import VendingMachine
+from vender.httpd import HttpServer
+from vender.inventory import Inventory
+from vender.log import Log
+from vender.metrics import Metrics
+from vender.oled import TextScreen
+from vender.outbox import Outbox
+from vender.publisher import Publisher
+from vender.qos import Sender
+from vender.servo import DutyTable, Profile, ServoMotion
+from vender.startup import BootProfile
+from vender.supervisor import Supervisor
+from vender.wire import Encoder
+
+# ---- Staged Startup ----
+# Only what local vending needs (inventory, keypad, servos) is set up
+# before the scheduler starts. The screen comes up in the background,
+# Wi-Fi and MQTT are joined by the supervisor, and every stage is printed
+# with its time since reset so time-to-first-vend can be tracked.
+boot = BootProfile()
+
+# Hot-path timings and counters, published on vender/metrics every minute
+# and printed by metrics.dump(). METRICS_ENABLED = False leaves the hot
+# paths unwrapped.
+METRICS_ENABLED = True
+metrics = Metrics(METRICS_ENABLED)
+
+# Log lines go into a RAM ring and are written out in the background, so
+# nothing waits on the UART. Warnings and errors also go to vender/log.
+# LOG_LEVEL: 0 debug, 1 info, 2 warnings, 3 errors, 4 off.
+LOG_LEVEL = 1
+log = Log(level=LOG_LEVEL)
 
 
 # ---- MQTT Implementation ----
-try:
-    from umqtt.robust import MQTTClient
-except:
-    from umqtt.simple import MQTTClient
+# umqtt.simple, not robust: robust retries inside every call and would
+# block the machine for as long as the network is down. The supervisor
+# reconnects in the background instead.
+from umqtt.simple import MQTTClient
 
 # ----- Wifi and MQTT Broker Configuration -----
 
 WIFI_SSID = "*********"
 WIFI_PASS = "********"
 
-MQTT_BROKER = "broker.hivemq.com"
-MQTT_PORT = 1883 
+# Tried in order; a broker.cfg file on the board replaces this list (see
+# vender/brokers.py), e.g. to use a local broker (python -m sim.mqttd).
+MQTT_BROKERS = (
+    ("broker.hivemq.com", 1883),
+    ("test.mosquitto.org", 1883),
+)
+brokers = BrokerList(MQTT_BROKERS)
+if brokers.skipped:
+    log.warn("broker.cfg: %d bad lines skipped", brokers.skipped)
 MQTT_CLIENT_ID = "esp32-vender-" + str(time.ticks_ms())
-
-MQTT_TOPIC_STATUS = b"vender/slot1/status"
-MQTT_TOPIC_EVENT = b"vender/slot1/event"
-COMMAND_TOPIC = b"vender/slot1/command"
+MQTT_KEEPALIVE = 60
+# Seconds to wait for the broker while connecting and subscribing (needs
+# umqtt.simple 1.4 or later); connecting blocks everything else.
+MQTT_TIMEOUT_S = 5
 
 mqtt_client = None
-SLOT_CAPACITY = 5
-snack_count = 2
+
+# Publishes are queued and sent together once per loop tick; repeated
+# status updates for a slot collapse to the latest one. While the broker
+# is unreachable they wait in the outbox (RAM, then flash) and are sent
+# in rate-limited batches once it is back.
+publisher = Publisher(outbox=Outbox("outbox.spool"))
+
+# ---- Slots ----
+# One line per slot: (keypad key, servo pin, capacity, starting count).
+# Slot 1 publishes on vender/slot1/status, vender/slot1/event and listens on
+# vender/slot1/command, slot 2 on vender/slot2/..., and so on. Commands with
+# replies (vender/command -> vender/reply) are described in vender/protocol.py.
+SLOTS = (
+    ("1", 27, 5, 2),
+)
+
+inventory = Inventory(SLOTS)
+
+# WIRE_BINARY = True sends slot status and events as compact binary records
+# on vender/wire (see vender/wire.py) instead of the text messages, for
+# metered links. Replies, metrics and log lines stay text either way.
+WIRE_BINARY = False
+if WIRE_BINARY:
+    publisher.wire = Encoder(inventory)
+
+# Vend events and command replies are sent QoS 1 (vender/qos.py): up to
+# QOS_WINDOW of them wait for their PUBACK at once, and any without one
+# after QOS_RETRY_MS is sent again. Status updates stay QoS 0, a newer one
+# replaces them anyway; with WIRE_BINARY, though, they share each flush's
+# one wire payload with the events, so that payload goes QoS 1 as a whole.
+QOS1_ENABLED = True
+QOS_WINDOW = 8
+QOS_RETRY_MS = 2000
+
+def qos1_topic(topic):
+    return (topic in inventory.event_topics or topic == inventory.reply_topic
+            or topic == inventory.wire_topic)
+
+if QOS1_ENABLED:
+    publisher.qos = Sender(qos1_topic, QOS_WINDOW, retry_ms=QOS_RETRY_MS, metrics=metrics)
+
+# Counts survive resets: every load and vend is journaled to flash, and
+# the saved counts replace the starting counts above at boot.
+journal = jr.Journal("inventory")
+if journal.restore(inventory.counts):
+    inventory.clamp()
+    log.info("Inventory restored: %s", list(inventory.counts))
 
 # ---- Screen Configuration ----
 # VCC=3.3v, GND, SDA=21, SCL=22
 I2C_SCL = 22
 I2C_SDA = 21
 
-i2c = I2C(0, scl=Pin(I2C_SCL), sda=Pin(I2C_SDA))
-oled = ssd1306.SSD1306_I2C(128,64, i2c, addr=0x3C)
-
-def display(line1, line2):
-    oled.fill(0)
-    oled.text("Vending Machine", 0, 0)
-    oled.text(line1, 0, 25)
-    oled.text(line2, 0, 45)
-    oled.show()
+# Header at y=0, the two message lines at y=25 and y=45. Only the pages
+# and columns that changed since the last update are sent to the panel.
+# The panel is set up by screen_task() once the scheduler runs; until
+# then draw_display() does nothing and the latest text waits in the core.
+screen = None
+
+def start_screen():
+    global screen
+    i2c = I2C(0, scl=Pin(I2C_SCL), sda=Pin(I2C_SDA))
+    oled = ssd1306.SSD1306_I2C(128,64, i2c, addr=0x3C)
+    screen = TextScreen(oled, (0, 25, 45))
+    screen.show = metrics.timed("show", screen.show)
+    screen.set(0, "Vending Machine")
+
+def draw_display(line1, line2):
+    if screen is None:
+        return
+    screen.set(1, line1)
+    screen.set(2, line2)
+    screen.show()
 
 # ---- Keypad Rows and Collums ----
 #Rows 1 - 4
@@ -65,178 +169,166 @@ KEYMAP = [
     ['*','0','#','D'],
 ]
 
+# Column interrupts wake the scanner; debounced key events come out of
+# keypad.get().
+keypad = kp.Keypad(rows, cols, KEYMAP)
+keypad.scan = metrics.timed("scan", keypad.scan)
+
 #---- Servo Setup ----
 
-SERVO_PIN = 27
-servo_pwm = PWM(Pin(SERVO_PIN), freq=50)
+# Calibration per slot, in slot order: Profile(min_duty, max_duty,
+# home_angle, vend_angle, vend_ms, return_ms), duties in 10-bit duty()
+# units at 50 Hz. Slots without their own line use the last one.
+SERVO_PROFILES = (
+    Profile(25, 125, 0, 180, 800, 400),
+)
 
-SERVO_HOME_ANGLE = 0
-SERVO_VEND_ANGLE = 180
+def make_servo(slot, pin, timer):
+    profile = SERVO_PROFILES[min(slot, len(SERVO_PROFILES) - 1)]
+    table = DutyTable(PWM(Pin(pin), freq=50), profile)
+    return ServoMotion(table.set_angle, timer=timer, profile=profile)
 
-def set_servo_angle(angle):
-    min_duty = 25
-    max_duty = 125
-    duty = int(min_duty + (angle/180.0)*(max_duty-min_duty))
-    try:
-        servo_pwm.duty(duty)
-    except AttributeError:
-        servo_pwm.duty_u16(int(duty * 64))
-
-
-# ---- Keypad Scanning ----
-def scan_keypad():
-    for r in range(4):
-        rows[r].value(0)
-        for c in range(4):
-            if cols[c].value() == 0:
-                rows[r].value(1)
-                return KEYMAP[r][c]
-        rows[r].value(1)
-    return None
-
-
-# ---- WiFi Connection ----
-def wifi_connect(timeout_s=10):
-    display("WiFi:", "Connecting...")
-    wlan = network.WLAN(network.STA_IF)
-    wlan.active(True)
-    wlan.connect(WIFI_SSID, WIFI_PASS)
-    
-    start = time.ticks_ms()
-    while not wlan.isconnected():
-        if time.ticks_diff(time.ticks_ms(), start) > timeout_s * 1000:
-            print("WiFi connect timeout")
-            display("WiFi:", "Failed (Offline)")
-            return None
-        time.sleep(0.5)
-           
-    print("WiFi Connected:", wlan.ifconfig())
-    display("WiFi:", "Connected")
-    time.sleep(2)
-    return wlan
-
-def on_message(topic, msg):
-    global mqtt_client
-    print("Got message:", topic, msg)
-    if topic == COMMAND_TOPIC and msg == b"vend":
-        print("Remote vend requested")
-        vend_snack()
+# Every slot has its own servo. Vends run one at a time, so they share
+# hardware timer 0 to run the stroke and nothing waits on the arm.
+servo_timer = Timer(0)
+servos = [make_servo(slot, pin, servo_timer) for slot, pin in enumerate(inventory.servo_pins)]
 
-# ---- MQTT Configuration ----
 
+# ---- Vending Logic ----
+# The state machine lives in vender/core.py; this script only builds the
+# drivers it needs and hands them over.
+vending = VendingMachine(inventory, servos, publisher, draw_display, journal, metrics, log)
+vending.on_vend = lambda slot: boot.mark("first_vend")
+display = vending.display
 
+# ---- MQTT Configuration ----
+# Called by the supervisor whenever Wi-Fi is up and there is no client;
+# any exception counts as a failed attempt and is retried with backoff.
 def mqtt_connect():
-    global mqtt_client
-    display("MQTT:", "Connecting...")
+    host, port = brokers.current()
+    client = MQTTClient(MQTT_CLIENT_ID, host, port=port, keepalive=MQTT_KEEPALIVE)
+    client.set_callback(vending.on_message)
     try:
-        client = MQTTClient(MQTT_CLIENT_ID, MQTT_BROKER, port=MQTT_PORT)
-        client.set_callback(on_message)
-        client.connect()
-        client.subscribe(COMMAND_TOPIC)
-        print("MQTT Connected and Subscribed!")
-        display("MQTT:", "Connected")
-        mqtt_client = client
-        time.sleep(1)
-        return client
-    except Exception as e:
-        print("MQTT connect failed:", e)
-        display("MQTT:", "Failed.")
-        time.sleep(1)
-        mqtt_client = None
-        return None
-    
-def publish_snack_status():
-    if mqtt_client:
-        mqtt_client.publish(
-            MQTT_TOPIC_STATUS,
-            ("count:%d" % snack_count).encode()
-        )
-
-# ---- Vending Routine ----
-def vend_snack():
-    global snack_count, mqtt_client
-    print("Vend_snack called, snack_count =", snack_count)
-
-    if snack_count <= 0:
-        print("No snack loaded!")
+        client.connect(timeout=MQTT_TIMEOUT_S)
+    except Exception:
+        brokers.failed()
+        raise
+    brokers.connected()
+    client.subscribe(inventory.command_topic)
+    for topic in inventory.command_topics:
+        client.subscribe(topic)
+    log.info("MQTT Connected and Subscribed! (%s:%d)", host, port)
+    return client
+
+def mqtt_online(client):
+    global mqtt_client
+    mqtt_client = client
+    publisher.client = client
+    if publisher.qos is not None:
+        publisher.qos.resend()
+    boot.mark("mqtt")
+
+def mqtt_offline():
+    global mqtt_client
+    log.warn("MQTT offline")
+    mqtt_client = None
+    publisher.client = None
+
+wlan = network.WLAN(network.STA_IF)
+supervisor = Supervisor(wlan, WIFI_SSID, WIFI_PASS, mqtt_connect, mqtt_online, mqtt_offline, log)
+publisher.on_error = supervisor.lost
+log.publish = lambda msg: publisher.event(inventory.log_topic, msg)
+publisher.flush = metrics.timed("flush", publisher.flush)
+metrics.gauge("connects", lambda: supervisor.mqtt_connects)
+metrics.gauge("queue_max", lambda: vending.queue.max_depth)
+metrics.gauge("log_dropped", lambda: log.dropped)
+if publisher.qos is not None:
+    metrics.gauge("qos_inflight", lambda: publisher.qos.used)
+    metrics.gauge("qos_retries", lambda: publisher.qos.retries)
+
+# Garbage is collected while nothing is happening (see vender/collector.py)
+# instead of whenever the heap happens to run out; pauses show up as the
+# "gc" timer in the metrics.
+collector = Collector(metrics, lambda: vending.idle() and not keypad.raw)
+
+# ---- Local HTTP ----
+# /status, /vend, /load and /metrics on port 80 for tools on the same
+# network (see vender/httpd.py). Set HTTP_TOKEN to require
+# "Authorization: Bearer <token>" on every request.
+HTTP_ENABLED = True
+HTTP_PORT = 80
+HTTP_TOKEN = None
+
+http = HttpServer(vending, metrics, HTTP_PORT, HTTP_TOKEN, log)
+
+# ---- Scheduler Tasks ----
+MQTT_POLL_MS = 10
+# A poll that comes round this many ms late counts as a loop overrun.
+OVERRUN_MS = 50
+
+async def mqtt_task():
+    last = time.ticks_ms()
+    while True:
         if mqtt_client:
-            mqtt_client.publish(MQTT_TOPIC_EVENT, b"vend_attempt_empty")
-        display("EMPTY", "Load snack (A)")
+            started = metrics.start()
+            try:
+                if publisher.qos is not None:
+                    publisher.qos.check_msg(mqtt_client)
+                else:
+                    mqtt_client.check_msg()
+            except OSError as e:
+                log.warn("MQTT link lost: %s", e)
+                supervisor.lost()
+            metrics.stop("check_msg", started)
+        publisher.flush()
+        await asyncio.sleep_ms(MQTT_POLL_MS)
+        now = time.ticks_ms()
+        if time.ticks_diff(now, last) > MQTT_POLL_MS + OVERRUN_MS:
+            metrics.count("overruns")
+        last = now
+
+async def screen_task():
+    global screen
+    try:
+        start_screen()
+    except OSError as e:
+        # No panel on the bus: run without one.
+        screen = None
+        log.warn("Display not started: %s", e)
         return
-    
-    print("Vending...(moving servo)")
-    if mqtt_client:
-        mqtt_client.publish(MQTT_TOPIC_EVENT, b"vend_start")
-
-# ---- Activating the servo motor ----
-    set_servo_angle(SERVO_VEND_ANGLE)
-    time.sleep(0.8)
-    set_servo_angle(SERVO_HOME_ANGLE)
-    time.sleep(0.4)
-
-    snack_count -= 1
-    print("After vend, snack_count =", snack_count)
-    publish_snack_status()
-
-    if snack_count > 0:
-        if mqtt_client:
-            mqtt_client.publish(MQTT_TOPIC_STATUS, b"loaded")
-        display("Vended!", "Left: %d" % snack_count)
-
+    boot.mark("display")
+    if vending.display_lines:
+        draw_display(*vending.display_lines)
     else:
-        if mqtt_client:
-            mqtt_client.publish(MQTT_TOPIC_STATUS, b"empty")
-        display("Slot Empty!", "Load snack")
+        screen.show()
+
+async def run_tasks():
+    vending.start()
+    boot.mark("ready")
+    if HTTP_ENABLED:
+        await http.run()
+    await asyncio.gather(
+        keypad.run(),
+        screen_task(),
+        mqtt_task(),
+        supervisor.run(),
+        collector.run(),
+        *vending.tasks(keypad)
+    )
+
+# ---- Main Function ----
+def start_up():
+    # The arms head home on their own; nothing needs to wait for them.
+    for servo in servos:
+        servo.set_angle(servo.home_angle)
+    boot.mark("drivers")
+
+    # Wi-Fi and MQTT come up in the background; the keypad works already.
+    display("Ready", "Press A to load")
 
-# ---- Main Function Loop ----
 def main():
-    global snack_count
-
-# ----- This shows that the script is running properly -----
-    display("Booting...", "Please wait")
-    time.sleep(1)
-
-    set_servo_angle(SERVO_HOME_ANGLE)
-    time.sleep(0.5)
-
-    wlan = wifi_connect()
-    client = mqtt_connect()
-
-    display ("Ready", "Press A to load")
-
-    last_key = None
-
-    while True:
-        key = scan_keypad()
-
-        if key and key != last_key:
-            print("Key pressed:", key)
-
-
-            # A = Load Snack
-            if key == "A":
-               if snack_count < SLOT_CAPACITY:
-                   snack_count += 1
-                   print("Snack loaded, snack_count =", snack_count)
-                   publish_snack_status()
-                   display("Snack Loaded", "Count: %d" % snack_count)
-                   if mqtt_client:
-                       mqtt_client.publish(MQTT_TOPIC_STATUS, b"load_snack")
-                
-               else:
-                   print("Slot already full")
-                   display("Slot Full", "Count: %d" % snack_count)
-
-            elif key in ("1", "#"):
-                print("Vend requested from keypad, snack_count =", snack_count)
-                vend_snack()
-
-
-        last_key = key
-
-        if mqtt_client:
-            mqtt_client.check_msg()
-
-        time.sleep(0.1)
+    start_up()
+    asyncio.run(run_tasks())
 
-main()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
\ No newline at end of file
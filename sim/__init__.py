@@ -0,0 +1,78 @@
+# ---- Host-side Hardware Simulator ----
+# Stand-ins for the MicroPython modules the firmware imports (`machine`,
+# `network`, `ssd1306`, `framebuf`, `umqtt`, `uasyncio`, `gc` and the
+# ESP32 flavour of `time`), so the unmodified firmware runs under CPython on virtual time.
+#
+#     board = Board()
+#     with installed(board):
+#         runpy.run_path("Final Vending Machine Code.py", run_name="__main__")
+
+import contextlib
+import random
+import sys
+
+from sim import board as _board_mod
+from sim import framebuf, gc, machine, network, ssd1306, uasyncio, usocket, utime, vfs
+from sim.board import Board, WifiLink
+from sim.broker import Broker
+from sim.clock import SimulationEnd, VirtualClock
+from sim.umqtt import robust as _umqtt_robust
+from sim.umqtt import simple as _umqtt_simple
+from sim import umqtt as _umqtt
+
+MODULES = {
+    'machine': machine,
+    'network': network,
+    'ssd1306': ssd1306,
+    'framebuf': framebuf,
+    'gc': gc,
+    'time': utime,
+    'utime': utime,
+    'uasyncio': uasyncio,
+    'usocket': usocket,
+    'umqtt': _umqtt,
+    'umqtt.simple': _umqtt_simple,
+    'umqtt.robust': _umqtt_robust,
+}
+
+# Firmware packages are re-imported inside every run so they bind the
+# simulated modules rather than whatever was loaded before.
+FIRMWARE_PACKAGES = ('vender',)
+
+
+def _is_firmware(name):
+    for pkg in FIRMWARE_PACKAGES:
+        if name == pkg or name.startswith(pkg + '.'):
+            return True
+    return False
+
+
+@contextlib.contextmanager
+def installed(board=None):
+    board = _board_mod.activate(board or Board())
+    saved = {name: sys.modules.get(name) for name in MODULES}
+    firmware = {name: mod for name, mod in sys.modules.items() if _is_firmware(name)}
+    for name in firmware:
+        del sys.modules[name]
+    sys.modules.update(MODULES)
+    vfs.install()
+    # Same board name, same backoff jitter: runs are repeatable.
+    random.seed(board.name)
+    try:
+        yield board
+    finally:
+        vfs.uninstall()
+        for name, mod in saved.items():
+            if mod is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = mod
+        for name in [n for n in sys.modules if _is_firmware(n)]:
+            del sys.modules[name]
+        sys.modules.update(firmware)
+
+
+__all__ = [
+    'Board', 'Broker', 'MODULES', 'SimulationEnd', 'VirtualClock', 'WifiLink',
+    'installed',
+]
@@ -0,0 +1,59 @@
+# ---- python -m sim ----
+#
+#   python -m sim --seconds 60 --keys "16000:A,17000:1" --remote "20000:vend"
+#   python -m sim --broker localhost:1883     against a real broker (sim.mqttd)
+
+import argparse
+import json
+
+from sim import runner
+from sim.board import Board, WifiLink
+from sim.clock import VirtualClock
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m sim',
+                                     description='Run the vending firmware on a simulated ESP32.')
+    parser.add_argument('script', nargs='?', default=runner.DEFAULT_SCRIPT)
+    parser.add_argument('--seconds', type=float, default=30,
+                        help='virtual seconds to run (default 30)')
+    parser.add_argument('--keys', default='',
+                        help='key presses as ms:key or ms:key:hold_ms, comma separated')
+    parser.add_argument('--bounce', type=int, default=0,
+                        help='contact bounces added to every key press and release')
+    parser.add_argument('--remote', default='',
+                        help='command topic payloads as ms:payload, comma separated')
+    parser.add_argument('--fs', default=None,
+                        help='directory used as the board filesystem, kept between runs')
+    parser.add_argument('--no-wifi', action='store_true',
+                        help='the access point never answers')
+    parser.add_argument('--outage', default='',
+                        help='Wi-Fi outages as start_ms-end_ms, comma separated')
+    parser.add_argument('--broker', default=None,
+                        help='host:port of a real MQTT broker to use instead of the '
+                             'simulated one (timings are then host timings)')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    parser.add_argument('--verbose', action='store_true', help='show firmware print() output')
+    args = parser.parse_args(argv)
+
+    clock = VirtualClock()
+    outages = [tuple(int(t) for t in span.split('-')) for span in args.outage.split(',') if span]
+    wifi = WifiLink(clock, available=not args.no_wifi, outages=outages)
+    broker_addr = None
+    if args.broker:
+        host, _, port = args.broker.rpartition(':')
+        broker_addr = (host, int(port))
+    board = Board(clock=clock, wifi=wifi, fs_dir=args.fs, broker_addr=broker_addr)
+    stats = runner.run(args.script, board=board, seconds=args.seconds,
+                       keys=runner.parse_schedule(args.keys),
+                       remote=runner.parse_schedule(args.remote),
+                       bounces=args.bounce,
+                       quiet=not args.verbose)
+    if args.json:
+        print(json.dumps(stats, indent=2))
+    else:
+        print(runner.format_report(stats))
+
+
+if __name__ == '__main__':
+    main()
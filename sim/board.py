@@ -0,0 +1,333 @@
+# ---- Simulated ESP32 Board ----
+# Holds the electrical state the firmware sees through `machine`, `network`
+# and `ssd1306`: a GPIO table with the 4x4 keypad matrix wired across it,
+# PWM channels, the I2C bus with an SSD1306 panel, a scripted Wi-Fi link and
+# a directory standing in for the flash filesystem.
+# Drivers capture the board that was current when they were constructed, so
+# several boards can share one clock and one broker. Code that runs later
+# (an MQTT client created by a background task) finds its board through a
+# context variable, which asyncio tasks inherit.
+
+import contextvars
+import os
+import tempfile
+
+from sim import clock as _clock
+from sim.broker import Broker
+
+# Same wiring as the firmware.
+ROW_PINS = [32, 33, 25, 26]
+COL_PINS = [19, 18, 5, 23]
+KEYMAP = [
+    ['1', '2', '3', 'A'],
+    ['4', '5', '6', 'B'],
+    ['7', '8', '9', 'C'],
+    ['*', '0', '#', 'D'],
+]
+
+OLED_ADDR = 0x3C
+
+# Commands that take argument bytes, and how many.
+_SSD1306_ARGS = {
+    0x20: 1, 0x21: 2, 0x22: 2, 0x81: 1, 0x8D: 1, 0xA8: 1,
+    0xD3: 1, 0xD5: 1, 0xD9: 1, 0xDA: 1, 0xDB: 1,
+}
+
+
+class PinState:
+    def __init__(self, pin_id):
+        self.id = pin_id
+        self.mode = None
+        self.pull = None
+        self.out = 1
+        self.irq_handler = None
+        self.irq_trigger = 0
+        self.level = 1
+
+
+class KeypadMatrix:
+    def __init__(self, board, row_pins=ROW_PINS, col_pins=COL_PINS, keymap=KEYMAP):
+        self.board = board
+        self.row_pins = row_pins
+        self.col_pins = col_pins
+        self.keymap = keymap
+        self.pressed = set()
+        self._where = {}
+        for r, row in enumerate(keymap):
+            for c, key in enumerate(row):
+                self._where[key] = (r, c)
+        self.presses = []
+
+    def col_level(self, c):
+        pins = self.board.pins
+        for r in range(len(self.row_pins)):
+            if (r, c) not in self.pressed:
+                continue
+            row = pins.get(self.row_pins[r])
+            if row is not None and row.mode == 'out' and row.out == 0:
+                return 0
+        return 1
+
+    def down(self, key):
+        self.pressed.add(self._where[key])
+        self.board.trace('key_down', key)
+        self.board.gpio_changed()
+
+    def up(self, key):
+        self.pressed.discard(self._where[key])
+        self.board.trace('key_up', key)
+        self.board.gpio_changed()
+
+    def press(self, key, at_ms=None, hold_ms=120, bounces=0):
+        # Each bounce adds a 0.5 ms open/close chatter on press and release.
+        clock = self.board.clock
+        start = clock.now_us if at_ms is None else at_ms * 1000
+        end = start + hold_ms * 1000
+        self.presses.append((start, key))
+        clock.call_at(start, lambda: self.down(key))
+        clock.call_at(end, lambda: self.up(key))
+        for i in range(bounces):
+            t = 500 + i * 1000
+            clock.call_at(start + t, lambda: self.up(key))
+            clock.call_at(start + t + 500, lambda: self.down(key))
+            clock.call_at(end + t, lambda: self.down(key))
+            clock.call_at(end + t + 500, lambda: self.up(key))
+
+
+class OledPanel:
+    # GDDRAM model of an SSD1306 in horizontal addressing mode.
+
+    def __init__(self, width=128, height=64):
+        self.width = width
+        self.pages = height // 8
+        self.ram = bytearray(self.width * self.pages)
+        self.col_start = 0
+        self.col_end = width - 1
+        self.page_start = 0
+        self.page_end = self.pages - 1
+        self.col = 0
+        self.page = 0
+        self.display_on = False
+        self._cmd = None
+        self._args = []
+        self.data_bytes = 0
+        self.writes = 0
+
+    def write(self, data):
+        self.writes += 1
+        control = data[0]
+        if control == 0x40:
+            self._data(data[1:])
+        elif control == 0x80:
+            self._command(data[1])
+        elif control == 0x00:
+            for b in data[1:]:
+                self._command(b)
+
+    def _command(self, b):
+        if self._cmd is not None:
+            self._args.append(b)
+        else:
+            self._cmd = b
+            self._args = []
+        need = _SSD1306_ARGS.get(self._cmd, 0)
+        if len(self._args) < need:
+            return
+        cmd, args = self._cmd, self._args
+        self._cmd = None
+        if cmd == 0x21:
+            self.col_start, self.col_end = args[0], args[1]
+            self.col = self.col_start
+        elif cmd == 0x22:
+            self.page_start, self.page_end = args[0], args[1]
+            self.page = self.page_start
+        elif cmd == 0xAF:
+            self.display_on = True
+        elif cmd == 0xAE:
+            self.display_on = False
+
+    def _data(self, data):
+        self.data_bytes += len(data)
+        for b in data:
+            if self.page < self.pages and self.col < self.width:
+                self.ram[self.page * self.width + self.col] = b
+            self.col += 1
+            if self.col > self.col_end:
+                self.col = self.col_start
+                self.page += 1
+                if self.page > self.page_end:
+                    self.page = self.page_start
+
+
+class WifiLink:
+    # Scripted access point: joins after `connect_ms`, refuses if `available`
+    # is False, and drops the station during each (start_ms, end_ms) outage.
+    # After an outage the station stays down until connect() is called again.
+
+    def __init__(self, clock, connect_ms=1500, available=True, outages=()):
+        self.clock = clock
+        self.connect_ms = connect_ms
+        self.available = available
+        self.outages = list(outages)
+        self.joined_at_us = None
+        self.connects = 0
+
+    def connect(self):
+        self.connects += 1
+        if not self.available:
+            self.joined_at_us = None
+            return
+        self.joined_at_us = self.clock.now_us + self.connect_ms * 1000
+
+    def disconnect(self):
+        self.joined_at_us = None
+
+    def is_up(self):
+        now = self.clock.now_us
+        if self.joined_at_us is None or now < self.joined_at_us:
+            return False
+        for start, end in self.outages:
+            if self.joined_at_us < end * 1000 and start * 1000 <= now:
+                self.joined_at_us = None
+                return False
+        return True
+
+
+class Board:
+    def __init__(self, name='esp32', clock=None, broker=None, wifi=None,
+                 sock_write_us=500, sock_byte_us=2, record=True, fs_dir=None,
+                 blocking=True, broker_addr=None):
+        self.name = name
+        # The firmware's flash filesystem: a host directory that relative
+        # paths resolve into while the board is current (see sim.vfs).
+        self.fs_dir = fs_dir or tempfile.mkdtemp(prefix='vender-sim-')
+        os.makedirs(self.fs_dir, exist_ok=True)
+        self.clock = clock or _clock.get()
+        self.broker = broker or Broker(self.clock)
+        self.wifi = wifi or WifiLink(self.clock)
+        self.sock_write_us = sock_write_us
+        self.sock_byte_us = sock_byte_us
+        self.sock_writes = 0
+        self.sock_bytes = 0
+        self.pins = {}
+        self.keypad = KeypadMatrix(self)
+        self.pwms = {}
+        self.i2c_devices = {OLED_ADDR: OledPanel()}
+        self.i2c_bytes = 0
+        self.i2c_busy_us = 0
+        self.gc_runs = 0
+        # Firmware port -> host loopback port of its listening sockets.
+        self.ports = {}
+        self.record = record
+        self.events = []
+        # With blocking=False, I2C transfers and blocking socket calls take
+        # no virtual time; a fleet sharing one clock uses this so one board
+        # waiting on its bus or its CONNACK doesn't stall every other board.
+        self.blocking = blocking
+        # (host, port) of a real MQTT broker to use instead of `broker`.
+        self.broker_addr = broker_addr
+
+    @property
+    def oled(self):
+        return self.i2c_devices[OLED_ADDR]
+
+    def trace(self, kind, data=None):
+        if self.record:
+            self.events.append((self.clock.now_us, kind, data))
+
+    def pin(self, pin_id):
+        state = self.pins.get(pin_id)
+        if state is None:
+            state = self.pins[pin_id] = PinState(pin_id)
+        return state
+
+    def read_pin(self, pin_id):
+        state = self.pin(pin_id)
+        if state.mode == 'out':
+            return state.out
+        if pin_id in self.keypad.col_pins:
+            return self.keypad.col_level(self.keypad.col_pins.index(pin_id))
+        return 0 if state.pull == 'down' else 1
+
+    def write_pin(self, pin_id, value):
+        state = self.pin(pin_id)
+        value = 1 if value else 0
+        if state.out == value:
+            return
+        state.out = value
+        if pin_id == self.keypad.row_pins[0] and value == 0:
+            self.trace('scan')
+        if pin_id in self.keypad.row_pins:
+            self.gpio_changed()
+
+    def gpio_changed(self):
+        # Fire edge interrupts on any input whose level moved.
+        for pin_id in self.keypad.col_pins:
+            state = self.pins.get(pin_id)
+            if state is None or state.mode != 'in':
+                continue
+            level = self.read_pin(pin_id)
+            if level == state.level:
+                continue
+            state.level = level
+            handler = state.irq_handler
+            if handler is None:
+                continue
+            # Trigger bits match machine.Pin.IRQ_FALLING (2) / IRQ_RISING (1).
+            if (level == 0 and state.irq_trigger & 2) or (level == 1 and state.irq_trigger & 1):
+                handler(state.pin_obj)
+
+    def i2c_write(self, addr, nbytes, freq):
+        device = self.i2c_devices.get(addr)
+        if device is None:
+            raise OSError(19)  # ENODEV, as the ESP32 port reports a NACK
+        # Address byte plus payload, 9 clocks per byte.
+        busy = (nbytes + 1) * 9 * 1000000 // freq
+        self.i2c_bytes += nbytes
+        self.i2c_busy_us += busy
+        self.trace('i2c', nbytes)
+        if self.blocking:
+            self.clock.advance(busy)
+        return device
+
+    def pwm_changed(self, pin_id, duty_u16):
+        self.trace('pwm', (pin_id, duty_u16))
+
+    def servo_angle(self, pin_id):
+        pwm = self.pwms.get(pin_id)
+        if pwm is None or not pwm.freq_hz:
+            return None
+        return duty_to_angle(pwm.duty_u16_value, pwm.freq_hz)
+
+
+def duty_to_angle(duty_u16, freq_hz=50):
+    # SG90: 0.5 ms .. 2.5 ms pulse maps to 0..180 degrees.
+    pulse_us = duty_u16 * (1000000 // freq_hz) // 65535
+    return (pulse_us - 500) * 180 // 2000
+
+
+_board = None
+_bound = contextvars.ContextVar('sim_board', default=None)
+
+
+def current():
+    global _board
+    board = _bound.get()
+    if board is not None:
+        return board
+    if _board is None:
+        _board = Board()
+    return _board
+
+
+def bind(board):
+    # Make `board` current for this context (and tasks created from it).
+    _bound.set(board)
+    return board
+
+
+def activate(board):
+    global _board
+    _board = board
+    _clock.set(board.clock)
+    return board
@@ -0,0 +1,340 @@
+# ---- MQTT 3.1.1 Broker Core ----
+# Stand-in for broker.hivemq.com. The protocol handling is sans-IO: each
+# network connection is a Connection that is fed raw bytes and hands the
+# bytes it wants to send to a `send` callback, so the same broker can sit
+# behind simulated sockets or a real transport. Supports CONNECT (clean and
+# persistent sessions, last will), PUBLISH QoS 0/1, SUBSCRIBE with + and #
+# wildcards, retained messages, UNSUBSCRIBE, PINGREQ and DISCONNECT.
+# expire() drops connections that outlived their keepalive; the owner of
+# the transport calls it now and then (sim/mqttd.py does, every second).
+
+import struct
+
+CONNECT = 0x10
+CONNACK = 0x20
+PUBLISH = 0x30
+PUBACK = 0x40
+SUBSCRIBE = 0x80
+SUBACK = 0x90
+UNSUBSCRIBE = 0xA0
+UNSUBACK = 0xB0
+PINGREQ = 0xC0
+PINGRESP = 0xD0
+DISCONNECT = 0xE0
+
+
+def topic_matches(pattern, topic):
+    p = pattern.split(b'/')
+    t = topic.split(b'/')
+    for i, part in enumerate(p):
+        if part == b'#':
+            return True
+        if i >= len(t):
+            return False
+        if part != b'+' and part != t[i]:
+            return False
+    return len(p) == len(t)
+
+
+def encode_length(n):
+    out = bytearray()
+    while True:
+        b = n & 0x7F
+        n >>= 7
+        if n:
+            out.append(b | 0x80)
+        else:
+            out.append(b)
+            return bytes(out)
+
+
+def publish_packet(topic, msg, qos=0, retain=False, pid=0, dup=False):
+    body = struct.pack('!H', len(topic)) + topic
+    if qos:
+        body += struct.pack('!H', pid)
+    body += msg
+    header = PUBLISH | (dup << 3) | (qos << 1) | (1 if retain else 0)
+    return bytes([header]) + encode_length(len(body)) + body
+
+
+def split_packet(buf):
+    # (packet type byte, body, total length) or None if incomplete.
+    if len(buf) < 2:
+        return None
+    n = 0
+    shift = 0
+    i = 1
+    while True:
+        if i >= len(buf):
+            return None
+        b = buf[i]
+        n |= (b & 0x7F) << shift
+        i += 1
+        if not b & 0x80:
+            break
+        shift += 7
+    if len(buf) < i + n:
+        return None
+    return buf[0], bytes(buf[i:i + n]), i + n
+
+
+class Session:
+    def __init__(self, client_id):
+        self.client_id = client_id
+        self.subscriptions = {}
+        self.clean = True
+        self.connection = None
+        self.pending = []
+        self.pid = 0
+
+    def next_pid(self):
+        self.pid = self.pid % 0xFFFF + 1
+        return self.pid
+
+
+class Connection:
+    def __init__(self, broker, send, owner=None):
+        self.broker = broker
+        self.send = send
+        self.owner = owner
+        self.session = None
+        self.keepalive = 0
+        self.will = None
+        self.buf = bytearray()
+        self.closed = False
+        self.inflight = {}
+        self.last_seen = broker.now_us()
+        # Called once the broker has closed the connection (takeover,
+        # keepalive, DISCONNECT), so the transport can hang up too.
+        self.on_close = None
+
+    def feed(self, data):
+        self.buf += data
+        while not self.closed:
+            parts = split_packet(self.buf)
+            if parts is None:
+                return
+            first, body, total = parts
+            del self.buf[:total]
+            self.last_seen = self.broker.now_us()
+            self._handle(first, body)
+
+    def _handle(self, first, body):
+        kind = first & 0xF0
+        if kind == CONNECT:
+            self._connect(body)
+        elif self.session is None:
+            self.close()
+        elif kind == PUBLISH:
+            self._publish(first, body)
+        elif kind == PUBACK:
+            self.inflight.pop(struct.unpack('!H', body[:2])[0], None)
+        elif kind == SUBSCRIBE:
+            self._subscribe(body)
+        elif kind == UNSUBSCRIBE:
+            pid = body[:2]
+            i = 2
+            while i < len(body):
+                n = struct.unpack('!H', body[i:i + 2])[0]
+                self.broker.unsubscribe(self.session, body[i + 2:i + 2 + n])
+                i += 2 + n
+            self.send(bytes([UNSUBACK, 2]) + pid)
+        elif kind == PINGREQ:
+            self.send(bytes([PINGRESP, 0]))
+        elif kind == DISCONNECT:
+            self.will = None
+            self.close()
+
+    def _connect(self, body):
+        n = struct.unpack('!H', body[:2])[0]
+        i = 2 + n
+        level = body[i]
+        flags = body[i + 1]
+        self.keepalive = struct.unpack('!H', body[i + 2:i + 4])[0]
+        i += 4
+        fields = []
+        while i < len(body):
+            n = struct.unpack('!H', body[i:i + 2])[0]
+            fields.append(body[i + 2:i + 2 + n])
+            i += 2 + n
+        if level != 4:
+            self.send(bytes([CONNACK, 2, 0, 1]))
+            self.close()
+            return
+        client_id = fields.pop(0)
+        if flags & 0x04:
+            self.will = (fields[0], fields[1], (flags >> 3) & 3, bool(flags & 0x20))
+        session, present = self.broker.attach(self, client_id, bool(flags & 0x02))
+        self.session = session
+        self.send(bytes([CONNACK, 2, 1 if present else 0, 0]))
+        for topic, msg, qos in session.pending:
+            self.deliver(topic, msg, qos)
+        session.pending = []
+
+    def _publish(self, first, body):
+        qos = (first >> 1) & 3
+        n = struct.unpack('!H', body[:2])[0]
+        topic = body[2:2 + n]
+        i = 2 + n
+        pid = 0
+        if qos:
+            pid = struct.unpack('!H', body[i:i + 2])[0]
+            i += 2
+        self.broker.route(topic, body[i:], qos, bool(first & 1), self)
+        if qos == 1:
+            self.send(bytes([PUBACK, 2]) + struct.pack('!H', pid))
+
+    def _subscribe(self, body):
+        pid = body[:2]
+        granted = bytearray()
+        topics = []
+        i = 2
+        while i < len(body):
+            n = struct.unpack('!H', body[i:i + 2])[0]
+            topic = body[i + 2:i + 2 + n]
+            qos = min(body[i + 2 + n], 1)
+            self.broker.subscribe(self.session, topic, qos)
+            topics.append((topic, qos))
+            granted.append(qos)
+            i += 3 + n
+        self.send(bytes([SUBACK]) + encode_length(2 + len(granted)) + pid + bytes(granted))
+        for pattern, qos in topics:
+            for topic, msg in self.broker.retained.items():
+                if topic_matches(pattern, topic):
+                    self.deliver(topic, msg, qos, retain=True)
+
+    def deliver(self, topic, msg, qos, retain=False):
+        pid = 0
+        if qos:
+            pid = self.session.next_pid()
+            self.inflight[pid] = (topic, msg)
+        self.send(publish_packet(topic, msg, qos, retain, pid))
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.broker.detach(self)
+        if self.on_close is not None:
+            self.on_close()
+
+
+class Broker:
+    def __init__(self, clock=None, deliver_us=20000, available=True, keep_log=True):
+        self.clock = clock
+        self.deliver_us = deliver_us
+        self.available = available
+        self.sessions = {}
+        self.retained = {}
+        # (time, sender client id, topic, msg) of every message routed; a
+        # long-running broker turns it off.
+        self.log = [] if keep_log else None
+        self.listeners = []
+        # pattern -> {session: None} (insertion ordered). Exact topics are a
+        # dict lookup; only wildcard patterns are matched one by one, so
+        # routing stays cheap with thousands of clients.
+        self.exact = {}
+        self.wildcards = {}
+
+    def now_us(self):
+        return self.clock.now_us if self.clock is not None else 0
+
+    def open(self, send, owner=None):
+        if not self.available:
+            raise OSError(111)  # ECONNREFUSED
+        return Connection(self, send, owner)
+
+    def attach(self, conn, client_id, clean):
+        session = self.sessions.get(client_id)
+        present = session is not None and not clean
+        if session is None or clean:
+            if session is not None:
+                self._forget(session)
+            session = self.sessions[client_id] = Session(client_id)
+        old = session.connection
+        if old is not None and old is not conn:
+            # MQTT 3.1.1: a new connection with the same id takes over.
+            old.will = None
+            old.close()
+        session.connection = conn
+        session.clean = clean
+        return session, present
+
+    def detach(self, conn):
+        session = conn.session
+        if session is not None and session.connection is conn:
+            session.connection = None
+            for topic, msg in conn.inflight.values():
+                session.pending.append((topic, msg, 1))
+            if session.clean:
+                self.sessions.pop(session.client_id, None)
+                self._forget(session)
+        if conn.will is not None:
+            topic, msg, qos, retain = conn.will
+            conn.will = None
+            self.route(topic, msg, qos, retain, None)
+
+    def _index(self, pattern):
+        if b'+' in pattern or b'#' in pattern:
+            return self.wildcards
+        return self.exact
+
+    def subscribe(self, session, pattern, qos):
+        session.subscriptions[pattern] = qos
+        self._index(pattern).setdefault(pattern, {})[session] = None
+
+    def unsubscribe(self, session, pattern):
+        if session.subscriptions.pop(pattern, None) is None:
+            return
+        index = self._index(pattern)
+        members = index.get(pattern)
+        if members is not None:
+            members.pop(session, None)
+            if not members:
+                del index[pattern]
+
+    def _forget(self, session):
+        for pattern in list(session.subscriptions):
+            self.unsubscribe(session, pattern)
+
+    def route(self, topic, msg, qos=0, retain=False, sender=None):
+        now = self.now_us()
+        if self.log is not None:
+            self.log.append((now, sender.session.client_id if sender else None, topic, msg))
+        if sender is not None and sender.owner is not None:
+            sender.owner.trace('publish', (topic, msg))
+        if retain:
+            if msg:
+                self.retained[topic] = msg
+            else:
+                self.retained.pop(topic, None)
+        matched = {}
+        for session in self.exact.get(topic, ()):
+            matched[session] = session.subscriptions[topic]
+        for pattern, members in self.wildcards.items():
+            if topic_matches(pattern, topic):
+                for session in members:
+                    sub_qos = session.subscriptions[pattern]
+                    if sub_qos > matched.get(session, -1):
+                        matched[session] = sub_qos
+        for session, best in list(matched.items()):
+            granted = min(qos, best)
+            if session.connection is not None:
+                session.connection.deliver(topic, msg, granted)
+            elif granted and not session.clean:
+                session.pending.append((topic, msg, granted))
+        for listener in self.listeners:
+            listener(now, topic, msg)
+
+    def publish(self, topic, msg, retain=False, qos=0):
+        # Host-side publish, e.g. a back-office command.
+        self.route(topic, msg, qos, retain, None)
+
+    def expire(self):
+        # Drop connections that missed 1.5x their keepalive (MQTT 3.1.1).
+        now = self.now_us()
+        for session in list(self.sessions.values()):
+            conn = session.connection
+            if conn is not None and conn.keepalive:
+                if now - conn.last_seen > conn.keepalive * 1500000:
+                    conn.close()
@@ -0,0 +1,76 @@
+# ---- Virtual Clock ----
+# Every simulated board shares one clock. Blocking sleeps, I2C transfers and
+# socket writes advance it instead of waiting, so a minute of firmware time
+# runs in a fraction of a second on the host.
+
+import heapq
+
+
+class SimulationEnd(SystemExit):
+    # SystemExit so firmware `except Exception` blocks and asyncio tasks
+    # can't swallow the end of the run.
+    pass
+
+
+class VirtualClock:
+    def __init__(self, start_us=0, deadline_us=None):
+        self.now_us = start_us
+        self.deadline_us = deadline_us
+        self._timers = []
+        self._seq = 0
+
+    def call_at(self, t_us, fn):
+        self._seq += 1
+        entry = [t_us, self._seq, fn]
+        heapq.heappush(self._timers, entry)
+        return entry
+
+    def call_later(self, delay_us, fn):
+        return self.call_at(self.now_us + delay_us, fn)
+
+    def cancel(self, entry):
+        entry[2] = None
+
+    def next_timer_us(self):
+        while self._timers and self._timers[0][2] is None:
+            heapq.heappop(self._timers)
+        if self._timers:
+            return self._timers[0][0]
+        return None
+
+    def advance(self, delta_us):
+        delta_us = int(delta_us)
+        if delta_us < 0:
+            delta_us = 0
+        target = self.now_us + delta_us
+        if self.deadline_us is not None and delta_us and target > self.deadline_us:
+            self._run_until(self.deadline_us)
+            raise SimulationEnd()
+        self._run_until(target)
+
+    def advance_to(self, t_us):
+        self.advance(t_us - self.now_us)
+
+    def _run_until(self, target):
+        while self._timers and self._timers[0][0] <= target:
+            entry = heapq.heappop(self._timers)
+            if entry[2] is None:
+                continue
+            if entry[0] > self.now_us:
+                self.now_us = entry[0]
+            entry[2]()
+        if target > self.now_us:
+            self.now_us = target
+
+
+_clock = VirtualClock()
+
+
+def get():
+    return _clock
+
+
+def set(clock):
+    global _clock
+    _clock = clock
+    return clock
@@ -0,0 +1,270 @@
+# ---- Fleet Simulator ----
+# Runs many independent copies of the firmware against one in-process broker
+# to see how the back office copes with a whole fleet: every machine gets
+# its own board, flash directory, client id and topic root
+# (fleet/<name>/slot1/...), scripted key presses and remote vend commands,
+# while all of them share one virtual clock and one event loop.
+#
+#   python -m sim.fleet --machines 2000 --seconds 60
+#
+# Commands use the correlation-id protocol (vender/protocol.py): a vend's
+# round trip runs from the back office publishing it to the machine's
+# `ack` on its reply topic, and its completion time to the final result.
+# --binary switches every machine to the binary telemetry of vender/wire.py,
+# to compare bytes on the wire with the text messages.
+
+import argparse
+import contextlib
+import contextvars
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import sim
+from sim import board as _board
+from sim import uasyncio
+from sim.board import Board, WifiLink
+from sim.broker import Broker
+from sim.clock import SimulationEnd, VirtualClock
+from sim.runner import DEFAULT_SCRIPT, ROOT, format_report, percentile
+from vender import wire
+
+TOPIC_ROOT = b'fleet/'
+VEND_START = b'vend_start'
+
+
+class Machine:
+    def __init__(self, board, namespace, context):
+        self.board = board
+        self.namespace = namespace
+        self.context = context
+        self.name = board.name.encode()
+        inventory = namespace['inventory']
+        self.command_topic = inventory.command_topic
+        self.reply_topic = inventory.reply_topic
+        self.event_topic = inventory.event_topics[0]
+        self.wire_topic = inventory.wire_topic
+
+
+def _load(code, script, board, binary=False):
+    # Runs inside the machine's own context: drivers created here, and every
+    # task the firmware starts later, see this board as current.
+    _board.bind(board)
+    namespace = {'__name__': 'fleet', '__file__': script}
+    exec(code, namespace)
+    # main() would run its own event loop; every machine shares one here,
+    # so the configuration is changed, main()'s start_up() is run and the
+    # caller starts run_tasks().
+    namespace['MQTT_CLIENT_ID'] = board.name
+    namespace['HTTP_ENABLED'] = False
+    namespace['inventory'].set_root(TOPIC_ROOT + board.name.encode() + b'/')
+    if binary:
+        # The firmware's own copy of the module, bound to the simulated time.
+        from vender.wire import Encoder
+        namespace['publisher'].wire = Encoder(namespace['inventory'])
+    namespace['start_up']()
+    return namespace
+
+
+class Fleet:
+    def __init__(self, machines=100, script=DEFAULT_SCRIPT, seed=1,
+                 deliver_us=20000, fs_root=None, binary=False):
+        self.script = os.path.abspath(script)
+        self.binary = binary
+        self.size = machines
+        self.rng = random.Random(seed)
+        self.clock = VirtualClock()
+        self.broker = Broker(self.clock, deliver_us=deliver_us)
+        self.fs_root = fs_root or tempfile.mkdtemp(prefix='vender-fleet-')
+        self.boards = []
+        for i in range(machines):
+            name = 'esp32-%05d' % i
+            wifi = WifiLink(self.clock, connect_ms=self.rng.randint(1000, 4000))
+            # Socket and I2C costs block the one shared clock, so they are
+            # left out; broker delivery delay still applies.
+            self.boards.append(Board(name, self.clock, self.broker, wifi,
+                                     sock_write_us=0, sock_byte_us=0,
+                                     record=False, blocking=False,
+                                     fs_dir=os.path.join(self.fs_root, name)))
+        self.machines = []
+        self.by_event_topic = {}
+        self.by_wire_topic = {}
+        self.by_reply_topic = {}
+        self.outstanding = {}
+        self.round_trips = []
+        self.completions = []
+        self.commands = 0
+        self.dropped = 0
+        self.presses = 0
+        self.vends = 0
+        self.broker.listeners.append(self._on_publish)
+
+    def schedule(self, seconds, key_per_min=2.0, command_per_min=1.0):
+        # Poisson key presses (load or vend) and remote vend commands for
+        # every machine, spread over the run.
+        end_ms = seconds * 1000
+        for board in self.boards:
+            at = self._next(0, key_per_min)
+            while at < end_ms:
+                board.keypad.press(self.rng.choice('A1'), at_ms=int(at))
+                self.presses += 1
+                at = self._next(at, key_per_min)
+        for index in range(self.size):
+            at = self._next(0, command_per_min)
+            while at < end_ms:
+                self.clock.call_at(int(at * 1000), self._command(index))
+                at = self._next(at, command_per_min)
+
+    def _next(self, at_ms, per_min):
+        if per_min <= 0:
+            return float('inf')
+        return at_ms + self.rng.expovariate(per_min / 60000.0)
+
+    def _command(self, index):
+        def send():
+            machine = self.machines[index]
+            self.commands += 1
+            session = self.broker.sessions.get(machine.name)
+            if session is None or session.connection is None:
+                # QoS 0 to a machine that isn't connected: nobody gets it.
+                self.dropped += 1
+                return
+            cid = b'%d' % self.commands
+            self.outstanding[(machine.name, cid)] = [self.clock.now_us, False]
+            self.broker.publish(machine.command_topic, cid + b' vend 1')
+        return send
+
+    def _on_publish(self, now_us, topic, msg):
+        if msg == VEND_START and topic in self.by_event_topic:
+            self.vends += 1
+            return
+        if topic in self.by_wire_topic:
+            for record in wire.decode(msg):
+                if record[0] == wire.VEND_START:
+                    self.vends += 1
+            return
+        machine = self.by_reply_topic.get(topic)
+        if machine is None:
+            return
+        cid, _, status = msg.partition(b' ')
+        key = (machine.name, cid)
+        waiting = self.outstanding.get(key)
+        if waiting is None:
+            return
+        elapsed = (now_us - waiting[0]) / 1000.0
+        if status == b'ack':
+            self.round_trips.append(elapsed)
+            waiting[1] = True
+        else:
+            if not waiting[1]:
+                self.round_trips.append(elapsed)
+            self.completions.append(elapsed)
+            del self.outstanding[key]
+
+    def run(self, seconds=60, quiet=True):
+        self.clock.deadline_us = self.clock.now_us + int(seconds * 1000000)
+        with open(self.script) as f:
+            code = compile(f.read(), self.script, 'exec')
+        if ROOT not in sys.path:
+            sys.path.insert(0, ROOT)
+        started = time.perf_counter()
+        with sim.installed(self.boards[0]):
+            with contextlib.ExitStack() as stack:
+                if quiet:
+                    devnull = stack.enter_context(open(os.devnull, 'w'))
+                    stack.enter_context(contextlib.redirect_stdout(devnull))
+                loop = uasyncio.new_event_loop()
+                for board in self.boards:
+                    context = contextvars.copy_context()
+                    namespace = context.run(_load, code, self.script, board, self.binary)
+                    machine = Machine(board, namespace, context)
+                    self.machines.append(machine)
+                    self.by_event_topic[machine.event_topic] = machine
+                    self.by_wire_topic[machine.wire_topic] = machine
+                    self.by_reply_topic[machine.reply_topic] = machine
+                    loop.create_task(namespace['run_tasks'](), context=context)
+                loaded = time.perf_counter()
+                try:
+                    loop.run_forever()
+                except SimulationEnd:
+                    pass
+                finally:
+                    uasyncio._shutdown(loop)
+        return self.summarize(loaded - started, time.perf_counter() - loaded)
+
+    def summarize(self, load_s, wall_s):
+        virtual_s = self.clock.now_us / 1000000.0
+        from_machines = sum(1 for _, sender, _, _ in self.broker.log if sender is not None)
+        online = sum(1 for session in self.broker.sessions.values()
+                     if session.connection is not None)
+        connects = sum(m.namespace['supervisor'].mqtt_connects for m in self.machines)
+        queues = [m.namespace['vending'].queue for m in self.machines]
+        rtt = self.round_trips
+        done = self.completions
+        return {
+            'machines': self.size,
+            'online': online,
+            'mqtt_connects': connects,
+            'virtual_s': virtual_s,
+            'load_s': load_s,
+            'wall_s': wall_s,
+            'speedup': virtual_s / wall_s if wall_s else 0.0,
+            'key_presses': self.presses,
+            'commands': self.commands,
+            'dropped': self.dropped,
+            'unanswered': sum(1 for _, acked in self.outstanding.values() if not acked),
+            'vends': self.vends,
+            'queue_max_depth': max(q.max_depth for q in queues) if queues else 0,
+            'queue_rejected': sum(sum(q.rejected) for q in queues),
+            'messages': from_machines,
+            'messages_per_s': from_machines / virtual_s if virtual_s else 0.0,
+            'messages_per_wall_s': from_machines / wall_s if wall_s else 0.0,
+            'socket_bytes': sum(board.sock_bytes for board in self.boards),
+            'rtt_ms_p50': percentile(rtt, 50),
+            'rtt_ms_p90': percentile(rtt, 90),
+            'rtt_ms_p99': percentile(rtt, 99),
+            'rtt_ms_max': max(rtt) if rtt else 0,
+            'vend_ms_p50': percentile(done, 50),
+            'vend_ms_p99': percentile(done, 99),
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m sim.fleet',
+                                     description='Run a fleet of simulated vending machines '
+                                                 'against one in-process broker.')
+    parser.add_argument('script', nargs='?', default=DEFAULT_SCRIPT)
+    parser.add_argument('--machines', type=int, default=1000,
+                        help='number of machines (default 1000)')
+    parser.add_argument('--seconds', type=float, default=60,
+                        help='virtual seconds to run (default 60)')
+    parser.add_argument('--keys', type=float, default=2.0,
+                        help='key presses per machine per minute (default 2)')
+    parser.add_argument('--commands', type=float, default=1.0,
+                        help='remote vend commands per machine per minute (default 1)')
+    parser.add_argument('--deliver-ms', type=float, default=20,
+                        help='broker delivery delay in ms (default 20)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--fs', default=None,
+                        help='directory holding one flash directory per machine')
+    parser.add_argument('--binary', action='store_true',
+                        help='send status and events as binary telemetry (vender/wire.py)')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args(argv)
+
+    fleet = Fleet(args.machines, args.script, seed=args.seed,
+                  deliver_us=int(args.deliver_ms * 1000), fs_root=args.fs,
+                  binary=args.binary)
+    fleet.schedule(args.seconds, args.keys, args.commands)
+    stats = fleet.run(args.seconds)
+    if args.json:
+        print(json.dumps(stats, indent=2))
+    else:
+        print(format_report(stats))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+# ---- MicroPython `framebuf` stand-in ----
+# MONO_VLSB only, which is all the SSD1306 driver uses. Glyphs are a
+# deterministic stand-in for the built-in 8x8 font: every printable
+# character gets a distinct, non-blank bit pattern, which is enough to
+# check what changed on the panel.
+
+MONO_VLSB = 0
+
+
+def _glyph(ch):
+    code = ord(ch)
+    if code == 32:
+        return b'\x00' * 8
+    cols = bytearray(8)
+    for x in range(1, 7):
+        cols[x] = ((code * (x + 3) * 37) ^ (code << x)) & 0x7E or 0x42
+    return bytes(cols)
+
+
+class FrameBuffer:
+    def __init__(self, buf, width, height, fmt, stride=None):
+        self.buf = buf
+        self.width = width
+        self.height = height
+        self.format = fmt
+
+    def pixel(self, x, y, c=None):
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            return None
+        index = (y >> 3) * self.width + x
+        bit = 1 << (y & 7)
+        if c is None:
+            return 1 if self.buf[index] & bit else 0
+        if c:
+            self.buf[index] |= bit
+        else:
+            self.buf[index] &= ~bit & 0xFF
+
+    def fill(self, c):
+        value = 0xFF if c else 0x00
+        for i in range(len(self.buf)):
+            self.buf[i] = value
+
+    def fill_rect(self, x, y, w, h, c):
+        for yy in range(max(y, 0), min(y + h, self.height)):
+            for xx in range(max(x, 0), min(x + w, self.width)):
+                self.pixel(xx, yy, c)
+
+    def rect(self, x, y, w, h, c, f=False):
+        if f:
+            self.fill_rect(x, y, w, h, c)
+            return
+        self.hline(x, y, w, c)
+        self.hline(x, y + h - 1, w, c)
+        self.vline(x, y, h, c)
+        self.vline(x + w - 1, y, h, c)
+
+    def hline(self, x, y, w, c):
+        self.fill_rect(x, y, w, 1, c)
+
+    def vline(self, x, y, h, c):
+        self.fill_rect(x, y, 1, h, c)
+
+    def text(self, s, x, y, c=1):
+        for ch in s:
+            glyph = _glyph(ch)
+            for dx in range(8):
+                column = glyph[dx]
+                for dy in range(8):
+                    if column & (1 << dy):
+                        self.pixel(x + dx, y + dy, c)
+            x += 8
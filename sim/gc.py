@@ -0,0 +1,47 @@
+# ---- MicroPython `gc` stand-in ----
+# The host's own collector keeps running as usual; collect() only charges
+# the board the time an ESP32 collection takes, so scheduling collections
+# shows up in the loop timings. mem_alloc() is what tracemalloc has traced
+# when it is running (sim.replay's memory pass), else 0, against a heap of
+# HEAP_BYTES.
+
+import gc as _gc
+import tracemalloc
+
+from sim import board as _board
+
+HEAP_BYTES = 111168
+COLLECT_US = 3000
+
+
+def collect():
+    board = _board.current()
+    board.gc_runs += 1
+    board.trace('gc')
+    if board.blocking:
+        board.clock.advance(COLLECT_US)
+
+
+def mem_alloc():
+    if tracemalloc.is_tracing():
+        return tracemalloc.get_traced_memory()[0]
+    return 0
+
+
+def mem_free():
+    return HEAP_BYTES - mem_alloc()
+
+
+def threshold(amount=None):
+    return -1
+
+
+enable = _gc.enable
+disable = _gc.disable
+isenabled = _gc.isenabled
+
+
+def __getattr__(name):
+    # Host code that imports gc while a board is installed still gets the
+    # rest of the real module.
+    return getattr(_gc, name)
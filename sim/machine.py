@@ -0,0 +1,177 @@
+# ---- MicroPython `machine` stand-in ----
+# Pin, PWM, I2C and Timer backed by the current simulated board.
+
+from sim import board as _board
+
+
+class Pin:
+    IN = 1
+    OUT = 3
+    OPEN_DRAIN = 7
+    PULL_UP = 2
+    PULL_DOWN = 1
+    IRQ_RISING = 1
+    IRQ_FALLING = 2
+
+    def __init__(self, pin_id, mode=-1, pull=-1, value=None):
+        self._board = _board.current()
+        self.id = pin_id
+        self._state = self._board.pin(pin_id)
+        self._state.pin_obj = self
+        self.init(mode, pull, value)
+
+    def init(self, mode=-1, pull=-1, value=None):
+        state = self._state
+        if mode == Pin.OUT or mode == Pin.OPEN_DRAIN:
+            state.mode = 'out'
+        elif mode == Pin.IN:
+            state.mode = 'in'
+        if pull == Pin.PULL_UP:
+            state.pull = 'up'
+        elif pull == Pin.PULL_DOWN:
+            state.pull = 'down'
+        if value is not None:
+            self.value(value)
+        if state.mode == 'in':
+            state.level = self._board.read_pin(self.id)
+
+    def value(self, v=None):
+        if v is None:
+            return self._board.read_pin(self.id)
+        self._board.write_pin(self.id, v)
+
+    def __call__(self, v=None):
+        return self.value(v)
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+    def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING):
+        self._state.irq_handler = handler
+        self._state.irq_trigger = trigger if handler else 0
+        self._state.level = self._board.read_pin(self.id)
+
+    def __repr__(self):
+        return 'Pin(%d)' % self.id
+
+
+class PWM:
+    def __init__(self, pin, freq=5000, duty=None, duty_u16=None):
+        self._board = _board.current()
+        self.pin_id = pin.id
+        self.freq_hz = freq
+        self.duty_u16_value = 0
+        self._board.pwms[self.pin_id] = self
+        if duty is not None:
+            self.duty(duty)
+        if duty_u16 is not None:
+            self.duty_u16(duty_u16)
+
+    def freq(self, hz=None):
+        if hz is None:
+            return self.freq_hz
+        self.freq_hz = hz
+
+    def duty(self, d=None):
+        # ESP32 legacy 10-bit duty.
+        if d is None:
+            return self.duty_u16_value >> 6
+        self.duty_u16(min(max(int(d), 0), 1023) * 65535 // 1023)
+
+    def duty_u16(self, d=None):
+        if d is None:
+            return self.duty_u16_value
+        d = min(max(int(d), 0), 65535)
+        if d != self.duty_u16_value:
+            self.duty_u16_value = d
+            self._board.pwm_changed(self.pin_id, d)
+
+    def deinit(self):
+        self.duty_u16(0)
+        self._board.pwms.pop(self.pin_id, None)
+
+
+class I2C:
+    def __init__(self, bus_id, scl=None, sda=None, freq=400000):
+        self._board = _board.current()
+        self.bus_id = bus_id
+        self.freq = freq
+
+    def scan(self):
+        return sorted(self._board.i2c_devices)
+
+    def writeto(self, addr, buf, stop=True):
+        device = self._board.i2c_write(addr, len(buf), self.freq)
+        device.write(bytes(buf))
+        return len(buf)
+
+    def writevto(self, addr, vector, stop=True):
+        data = b''.join(bytes(v) for v in vector)
+        device = self._board.i2c_write(addr, len(data), self.freq)
+        device.write(data)
+        return len(data)
+
+
+class Timer:
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self, timer_id, mode=PERIODIC, period=-1, callback=None):
+        self._board = _board.current()
+        self.id = timer_id
+        self._entry = None
+        if callback is not None:
+            self.init(mode=mode, period=period, callback=callback)
+
+    def init(self, mode=PERIODIC, period=-1, freq=-1, callback=None):
+        self.deinit()
+        if freq > 0:
+            period = 1000 // freq
+        self._mode = mode
+        self._period_us = max(int(period), 1) * 1000
+        self._callback = callback
+        self._arm()
+
+    def _arm(self):
+        self._entry = self._board.clock.call_later(self._period_us, self._fire)
+
+    def _fire(self):
+        self._entry = None
+        if self._mode == Timer.PERIODIC:
+            self._arm()
+        if self._callback:
+            self._callback(self)
+
+    def deinit(self):
+        if self._entry is not None:
+            self._board.clock.cancel(self._entry)
+            self._entry = None
+
+
+def unique_id():
+    name = _board.current().name.encode()
+    return (name + b'\x00' * 6)[:6]
+
+
+def freq(hz=None):
+    if hz is None:
+        return 240000000
+
+
+def idle():
+    pass
+
+
+def reset():
+    raise SystemExit('machine.reset()')
+
+
+def disable_irq():
+    return 0
+
+
+def enable_irq(state=0):
+    pass
@@ -0,0 +1,121 @@
+# ---- Local MQTT Broker ----
+# The simulator's broker core (broker.py) behind a real TCP listener, so a
+# real board, `python -m sim --broker`, or any MQTT client can be pointed at
+# a broker on the bench instead of broker.hivemq.com. MQTT 3.1.1 with QoS
+# 0/1, retained messages, persistent sessions and keepalive.
+#
+#   python -m sim.mqttd                      listen on 0.0.0.0:1883
+#   python -m sim.mqttd --port 1884 --report 5
+#
+# Every --report seconds it prints the connected clients and the message
+# and byte rates seen since the last report.
+
+import argparse
+import asyncio
+import socket
+import struct
+import time
+
+from sim.broker import CONNECT, DISCONNECT, Broker, publish_packet
+
+PORT = 1883
+EXPIRE_S = 1.0
+
+
+class WallClock:
+    @property
+    def now_us(self):
+        return int(time.monotonic() * 1000000)
+
+
+class Server:
+    def __init__(self, broker=None):
+        self.broker = broker or Broker(WallClock(), keep_log=False)
+        self.broker.listeners.append(self._on_route)
+        self.clients = 0
+        self.connections = 0
+        self.messages = 0
+        self.bytes_in = 0
+        self.server = None
+
+    def _on_route(self, now_us, topic, msg):
+        self.messages += 1
+
+    async def start(self, host='0.0.0.0', port=PORT):
+        self.server = await asyncio.start_server(self._serve, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def _serve(self, reader, writer):
+        conn = self.broker.open(writer.write)
+        conn.on_close = writer.close
+        self.clients += 1
+        self.connections += 1
+        try:
+            while not conn.closed:
+                data = await reader.read(4096)
+                if not data:
+                    break
+                self.bytes_in += len(data)
+                conn.feed(data)
+        except OSError:
+            pass
+        finally:
+            self.clients -= 1
+            conn.close()
+            writer.close()
+
+    async def expire(self, interval_s=EXPIRE_S):
+        while True:
+            await asyncio.sleep(interval_s)
+            self.broker.expire()
+
+    async def report(self, interval_s):
+        messages = self.messages
+        bytes_in = self.bytes_in
+        while True:
+            await asyncio.sleep(interval_s)
+            print('clients %d  connects %d  msgs/s %.1f  in B/s %.0f  retained %d'
+                  % (self.clients, self.connections,
+                     (self.messages - messages) / interval_s,
+                     (self.bytes_in - bytes_in) / interval_s,
+                     len(self.broker.retained)), flush=True)
+            messages = self.messages
+            bytes_in = self.bytes_in
+
+
+def publish(addr, topic, msg, retain=False, client_id=b'sim-publisher'):
+    # One-shot QoS 0 publish from the host: connect, publish, disconnect.
+    body = (struct.pack('!H', 4) + b'MQTT' + bytes([4, 0x02]) + struct.pack('!H', 0)
+            + struct.pack('!H', len(client_id)) + client_id)
+    with socket.create_connection(addr, timeout=5) as sock:
+        sock.sendall(bytes([CONNECT, len(body)]) + body)
+        sock.recv(4)
+        sock.sendall(publish_packet(topic, msg, retain=retain) + bytes([DISCONNECT, 0]))
+
+
+async def _main(args):
+    server = Server()
+    port = await server.start(args.host, args.port)
+    print('MQTT broker on %s:%d' % (args.host, port), flush=True)
+    tasks = [server.expire()]
+    if args.report:
+        tasks.append(server.report(args.report))
+    await asyncio.gather(*tasks)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m sim.mqttd',
+                                     description='Run a local MQTT 3.1.1 broker.')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--report', type=float, default=10,
+                        help='seconds between rate reports (0: none)')
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(_main(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+# ---- MicroPython `network` stand-in ----
+
+from sim import board as _board
+
+STA_IF = 0
+AP_IF = 1
+
+STAT_IDLE = 1000
+STAT_CONNECTING = 1001
+STAT_GOT_IP = 1010
+STAT_NO_AP_FOUND = 201
+
+
+class WLAN:
+    def __init__(self, interface=STA_IF):
+        self._board = _board.current()
+        self._link = self._board.wifi
+        self._active = False
+
+    def active(self, is_active=None):
+        if is_active is None:
+            return self._active
+        self._active = bool(is_active)
+        if not self._active:
+            self._link.disconnect()
+
+    def connect(self, ssid=None, key=None):
+        if not self._active:
+            raise OSError('Wifi Not Started')
+        self._link.connect()
+
+    def disconnect(self):
+        self._link.disconnect()
+
+    def isconnected(self):
+        return self._active and self._link.is_up()
+
+    def status(self, param=None):
+        if self.isconnected():
+            return STAT_GOT_IP
+        if self._link.joined_at_us is not None:
+            return STAT_CONNECTING
+        if self._link.connects and not self._link.available:
+            return STAT_NO_AP_FOUND
+        return STAT_IDLE
+
+    def ifconfig(self):
+        if not self.isconnected():
+            return ('0.0.0.0', '0.0.0.0', '0.0.0.0', '0.0.0.0')
+        return ('192.168.4.2', '255.255.255.0', '192.168.4.1', '192.168.4.1')
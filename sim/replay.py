@@ -0,0 +1,199 @@
+# ---- Replay Benchmarks ----
+# Replays recorded traces of key presses, MQTT commands and Wi-Fi outages
+# through the firmware on a fresh simulated board and reports throughput,
+# per-event latency percentiles and the traffic it caused. Everything runs
+# on virtual time from a fixed seed, so two runs of the same tree give the
+# same numbers, and --baseline shows how a change moved them. The host_
+# metrics (and wall_s) measure the simulator on this host instead: they
+# vary from run to run and are shown but never flagged.
+#
+#   python -m sim.replay                       every trace in sim/traces
+#   python -m sim.replay burst --json > before.json
+#   python -m sim.replay burst --baseline before.json
+#
+# Trace lines, times in ms from reset (comments: lines starting with '#',
+# or after " # "):
+#
+#   16000 key A              press A (held 120 ms)
+#   16500 key 1 300          press 1, held 300 ms
+#   17000 mqtt vender/command 7 vend 1
+#   20000 outage 5000        Wi-Fi drops for 5 s
+#
+# Key latency is the time to the first thing the customer can observe;
+# command latency is the time to the first reply carrying the command's
+# id (commands without an id count as events but have no latency).
+
+import argparse
+import glob
+import json
+import os
+import tracemalloc
+
+from sim import runner
+from sim.board import Board, WifiLink
+from sim.clock import VirtualClock
+from sim.runner import percentile
+
+TRACE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'traces')
+TAIL_MS = 5000
+
+# Which way is better, for flagging regressions against a baseline.
+LOWER_IS_BETTER = ('_ms_', 'missed')
+HIGHER_IS_BETTER = ('events_per_s',)
+HOST_ONLY = ('wall_s', 'host_')
+
+
+def load_trace(path):
+    events = []
+    with open(path) as f:
+        for line in f:
+            # '#' is also a key, so comments are whole lines or " # ".
+            line = line.split(' # ', 1)[0].strip()
+            if not line or line.startswith('#'):
+                continue
+            at, kind, rest = (line.split(None, 2) + [''])[:3]
+            events.append((int(at), kind, rest))
+    events.sort(key=lambda e: e[0])
+    return events
+
+
+def find_trace(name):
+    if os.path.exists(name):
+        return name
+    return os.path.join(TRACE_DIR, name + '.trace')
+
+
+def _replay(path, script, events, seconds):
+    clock = VirtualClock()
+    outages = [(at, at + int(rest)) for at, kind, rest in events if kind == 'outage']
+    board = Board(os.path.basename(path), clock, wifi=WifiLink(clock, outages=outages))
+    sent = {}
+    latency = []
+
+    def on_publish(now_us, topic, msg):
+        if topic.endswith(b'/reply'):
+            cid = msg.split(b' ', 1)[0]
+            started = sent.pop(cid, None)
+            if started is not None:
+                latency.append((now_us - started) / 1000.0)
+
+    def publisher(topic, payload):
+        def send():
+            cid = payload.split(b' ', 1)[0]
+            if b' ' in payload:
+                sent[cid] = clock.now_us
+            board.broker.publish(topic, payload)
+        return send
+
+    board.broker.listeners.append(on_publish)
+    keys = []
+    for at, kind, rest in events:
+        if kind == 'key':
+            key, _, hold = rest.partition(' ')
+            keys.append((at, key + (':' + hold if hold else '')))
+        elif kind == 'mqtt':
+            topic, _, payload = rest.partition(' ')
+            clock.call_at(at * 1000, publisher(topic.encode(), payload.encode()))
+        elif kind != 'outage':
+            raise ValueError('%s: unknown event %r' % (path, kind))
+    stats = runner.run(script, seconds, keys=keys, board=board)
+    return board, stats, latency, len(sent)
+
+
+def run_trace(path, script=runner.DEFAULT_SCRIPT):
+    events = load_trace(path)
+    seconds = ((events[-1][0] if events else 0) + TAIL_MS) / 1000.0
+    board, stats, cmd_lat, unanswered = _replay(path, script, events, seconds)
+    key_lat, missed = runner.key_latencies(board)
+
+    # Same trace again under tracemalloc, which slows the host down too
+    # much to share a run with the timing.
+    tracemalloc.start()
+    _replay(path, script, events, seconds)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    virtual_s = stats['virtual_s']
+    wall_s = stats['wall_s']
+    return {
+        'events': len(events),
+        'virtual_s': virtual_s,
+        'events_per_s': len(events) / virtual_s if virtual_s else 0.0,
+        'key_ms_p50': percentile(key_lat, 50),
+        'key_ms_p90': percentile(key_lat, 90),
+        'key_ms_p99': percentile(key_lat, 99),
+        'key_ms_max': max(key_lat) if key_lat else 0,
+        'cmd_ms_p50': percentile(cmd_lat, 50),
+        'cmd_ms_p90': percentile(cmd_lat, 90),
+        'cmd_ms_p99': percentile(cmd_lat, 99),
+        'cmd_ms_max': max(cmd_lat) if cmd_lat else 0,
+        'missed': missed + unanswered,
+        'vends': stats['vends'],
+        'publishes': stats['publishes'],
+        'socket_writes': stats['socket_writes'],
+        'i2c_bytes': stats['i2c_bytes'],
+        'wall_s': wall_s,
+        'host_events_per_s': len(events) / wall_s if wall_s else 0.0,
+        'host_mem_peak_kb': peak / 1024.0,
+    }
+
+
+def compare(name, stats, base):
+    lines = ['%s (vs baseline)' % name]
+    for key, value in stats.items():
+        old = base.get(key)
+        if old is None or not isinstance(value, (int, float)):
+            continue
+        if old == value:
+            change = '='
+        elif old:
+            change = '%+.1f%%' % ((value - old) * 100.0 / old)
+        else:
+            change = 'new'
+        if any(key.startswith(word) for word in HOST_ONLY):
+            worse = False
+        elif any(word in key for word in LOWER_IS_BETTER):
+            worse = value > old
+        else:
+            worse = key in HIGHER_IS_BETTER and value < old
+        flag = '  <- worse' if worse else ''
+        lines.append('  %-16s %10.2f %10.2f  %s%s' % (key, old, value, change, flag))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m sim.replay',
+                                     description='Replay recorded traces through the firmware '
+                                                 'and report latency and throughput.')
+    parser.add_argument('traces', nargs='*',
+                        help='trace names in sim/traces or paths (default: all)')
+    parser.add_argument('--script', default=runner.DEFAULT_SCRIPT)
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    parser.add_argument('--baseline', default=None,
+                        help='JSON from an earlier --json run to compare against')
+    args = parser.parse_args(argv)
+
+    paths = [find_trace(t) for t in args.traces] or sorted(glob.glob(os.path.join(TRACE_DIR, '*.trace')))
+    results = {}
+    for path in paths:
+        name = os.path.splitext(os.path.basename(path))[0]
+        results[name] = run_trace(path, args.script)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    for name, stats in results.items():
+        if name in baseline:
+            print(compare(name, stats, baseline[name]))
+        else:
+            print(name)
+            print(runner.format_report(stats))
+        print()
+
+
+if __name__ == '__main__':
+    main()
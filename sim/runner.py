@@ -0,0 +1,167 @@
+# ---- Simulation Runner ----
+# Runs a firmware script on a simulated board for a fixed span of virtual
+# time and reduces the board's event trace to loop-latency and vend
+# throughput figures.
+
+import contextlib
+import os
+import runpy
+import sys
+import time
+
+import sim
+from sim.board import Board, duty_to_angle
+from sim.clock import SimulationEnd, VirtualClock
+from sim import mqttd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SCRIPT = os.path.join(ROOT, 'Final Vending Machine Code.py')
+
+COMMAND_TOPIC = b'vender/slot1/command'
+
+
+def parse_schedule(text):
+    # "1000:A,1500:1:2000" -> [(1000, 'A'), (1500, '1:2000')]
+    items = []
+    if not text:
+        return items
+    for part in text.split(','):
+        at, _, value = part.strip().partition(':')
+        items.append((int(at), value))
+    return items
+
+
+def run(script=DEFAULT_SCRIPT, seconds=30, keys=(), remote=(), board=None,
+        quiet=True, bounces=0):
+    script = os.path.abspath(script)
+    if board is None:
+        board = Board(clock=VirtualClock())
+    clock = board.clock
+    clock.deadline_us = clock.now_us + int(seconds * 1000000)
+    for at_ms, key in keys:
+        # "key" or "key:hold_ms"
+        key, _, hold = key.partition(':')
+        board.keypad.press(key, at_ms=at_ms, hold_ms=int(hold or 120), bounces=bounces)
+    for at_ms, payload in remote:
+        clock.call_at(at_ms * 1000, _remote(board, payload))
+
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    started = time.perf_counter()
+    with sim.installed(board):
+        with contextlib.ExitStack() as stack:
+            if quiet:
+                devnull = stack.enter_context(open(os.devnull, 'w'))
+                stack.enter_context(contextlib.redirect_stdout(devnull))
+            try:
+                runpy.run_path(script, run_name='__main__')
+            except SimulationEnd:
+                pass
+    return summarize(board, time.perf_counter() - started)
+
+
+def _remote(board, payload):
+    def send():
+        board.trace('remote', payload)
+        if board.broker_addr is not None:
+            mqttd.publish(board.broker_addr, COMMAND_TOPIC, payload.encode())
+        else:
+            board.broker.publish(COMMAND_TOPIC, payload.encode())
+    return send
+
+
+def percentile(values, pct):
+    if not values:
+        return 0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def key_latencies(board):
+    # A key press is answered by anything the customer can observe: the
+    # screen, a publish or the servo. Returns (latencies in ms, presses
+    # that got no answer before the next one).
+    events = board.events
+    responses = [t for t, kind, _ in events if kind in ('i2c', 'publish', 'pwm')]
+    presses = [t for t, kind, _ in events if kind == 'key_down']
+    latencies = []
+    missed = 0
+    j = 0
+    for i, t in enumerate(presses):
+        limit = presses[i + 1] if i + 1 < len(presses) else board.clock.now_us
+        while j < len(responses) and responses[j] < t:
+            j += 1
+        if j < len(responses) and responses[j] < limit:
+            latencies.append((responses[j] - t) / 1000.0)
+        else:
+            missed += 1
+    return latencies, missed
+
+
+def summarize(board, wall_s=0.0):
+    events = board.events
+    virtual_s = board.clock.now_us / 1000000.0
+
+    # How long each pass of the scheduler kept it from running anything
+    # else.
+    busy = [us / 1000.0 for _, kind, us in events if kind == 'loop']
+
+    # A remote command is answered by the firmware picking it up from the
+    # broker (FIFO order).
+    presses = [t for t, kind, _ in events if kind == 'key_down']
+    remotes = [t for t, kind, _ in events if kind == 'remote']
+    receives = [t for t, kind, _ in events if kind == 'receive']
+    key_lat, missed = key_latencies(board)
+    remote_lat = [(r - t) / 1000.0 for t, r in zip(remotes, receives)]
+    missed += max(0, len(remotes) - len(receives))
+
+    # Every servo leaving home counts as one vend stroke.
+    vends = 0
+    first_vend = None
+    raised = {}
+    for t, kind, data in events:
+        if kind != 'pwm':
+            continue
+        pin, duty = data
+        up = duty_to_angle(duty) > 20
+        if up and not raised.get(pin):
+            vends += 1
+            if first_vend is None:
+                first_vend = t
+        raised[pin] = up
+
+    return {
+        'virtual_s': virtual_s,
+        'wall_s': wall_s,
+        'speedup': virtual_s / wall_s if wall_s else 0.0,
+        'loop_iterations': len(busy),
+        'loop_ms_p50': percentile(busy, 50),
+        'loop_ms_p99': percentile(busy, 99),
+        'loop_ms_max': max(busy) if busy else 0,
+        'inputs': len(presses) + len(remotes),
+        'missed_inputs': missed,
+        'key_latency_ms_p50': percentile(key_lat, 50),
+        'key_latency_ms_max': max(key_lat) if key_lat else 0,
+        'remote_latency_ms_p50': percentile(remote_lat, 50),
+        'remote_latency_ms_max': max(remote_lat) if remote_lat else 0,
+        'vends': vends,
+        'vends_per_min': vends * 60.0 / virtual_s if virtual_s else 0.0,
+        'first_vend_ms': first_vend / 1000.0 if first_vend is not None else -1,
+        'i2c_bytes': board.i2c_bytes,
+        'i2c_busy_ms': board.i2c_busy_us / 1000.0,
+        'publishes': sum(1 for _, kind, _ in events if kind == 'publish'),
+        'socket_writes': board.sock_writes,
+        'socket_bytes': board.sock_bytes,
+        'gc_runs': board.gc_runs,
+    }
+
+
+def format_report(stats):
+    lines = []
+    for name, value in stats.items():
+        if isinstance(value, float):
+            lines.append('%-24s %.2f' % (name, value))
+        else:
+            lines.append('%-24s %s' % (name, value))
+    return '\n'.join(lines)
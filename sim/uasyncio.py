@@ -0,0 +1,152 @@
+# ---- MicroPython `uasyncio` stand-in ----
+# CPython asyncio on an event loop whose clock is the simulated one. When the
+# loop would block waiting for its next timer, the virtual clock jumps ahead
+# instead (stopping early for any pending hardware event, such as a key
+# press that fires a pin interrupt). Each pass of the loop is traced on the
+# board as 'loop' with how long it kept the loop busy, which is how late it
+# could have made any other task.
+#
+# start_server() listens on a free port of the host's loopback instead of
+# the port asked for, and notes it in the board's `ports`, so every board
+# in a run can serve "port 80" and tools find it there.
+
+import asyncio as _asyncio
+import math
+import selectors
+
+from sim import board as _board
+from sim import clock as _clock
+from sim.clock import SimulationEnd
+
+from asyncio import (  # noqa: F401 - re-exported API
+    CancelledError, Event, Lock, TimeoutError, create_task, current_task,
+    gather, open_connection, sleep, wait_for,
+)
+
+
+class _VirtualSelector:
+    def __init__(self, clock):
+        self._clock = clock
+        self._real = selectors.DefaultSelector()
+        self._woke_us = None
+
+    def register(self, fileobj, events, data=None):
+        return self._real.register(fileobj, events, data)
+
+    def unregister(self, fileobj):
+        return self._real.unregister(fileobj)
+
+    def modify(self, fileobj, events, data=None):
+        return self._real.modify(fileobj, events, data)
+
+    def get_key(self, fileobj):
+        return self._real.get_key(fileobj)
+
+    def get_map(self):
+        return self._real.get_map()
+
+    def close(self):
+        self._real.close()
+
+    def select(self, timeout=None):
+        # The clock only moves between two select()s while callbacks block
+        # (socket writes, I2C transfers).
+        clock = self._clock
+        if self._woke_us is not None:
+            _board.current().trace('loop', clock.now_us - self._woke_us)
+        ready = self._wait(timeout)
+        self._woke_us = clock.now_us
+        return ready
+
+    def _wait(self, timeout):
+        ready = self._real.select(0)
+        if ready or timeout == 0:
+            return ready
+        clock = self._clock
+        target = None
+        if timeout is not None:
+            target = clock.now_us + int(math.ceil(timeout * 1000000))
+        hardware = clock.next_timer_us()
+        if hardware is not None and (target is None or hardware < target):
+            target = hardware
+        if target is None:
+            # Nothing can ever wake the loop again.
+            if clock.deadline_us is None:
+                raise SimulationEnd()
+            target = clock.deadline_us + 1
+        clock.advance_to(target)
+        return self._real.select(0)
+
+
+class VirtualTimeLoop(_asyncio.SelectorEventLoop):
+    def __init__(self, clock=None):
+        self._virtual_clock = clock or _clock.get()
+        super().__init__(_VirtualSelector(self._virtual_clock))
+
+    def time(self):
+        return self._virtual_clock.now_us / 1000000.0
+
+
+class ThreadSafeFlag:
+    def __init__(self):
+        self._event = Event()
+
+    def set(self):
+        self._event.set()
+
+    def clear(self):
+        self._event.clear()
+
+    async def wait(self):
+        await self._event.wait()
+        self._event.clear()
+
+
+async def start_server(callback, host, port, backlog=5):
+    board = _board.current()
+    server = await _asyncio.start_server(callback, '127.0.0.1', 0, backlog=backlog)
+    board.ports[port] = server.sockets[0].getsockname()[1]
+    return server
+
+
+async def sleep_ms(ms):
+    await sleep(ms / 1000.0)
+
+
+async def wait_for_ms(aw, timeout):
+    return await wait_for(aw, timeout / 1000.0)
+
+
+def new_event_loop():
+    loop = VirtualTimeLoop()
+    _asyncio.set_event_loop(loop)
+    return loop
+
+
+def get_event_loop():
+    try:
+        return _asyncio.get_running_loop()
+    except RuntimeError:
+        return new_event_loop()
+
+
+def run(coro):
+    loop = new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        _shutdown(loop)
+
+
+def _shutdown(loop):
+    tasks = [t for t in _asyncio.all_tasks(loop) if not t.done()]
+    for task in tasks:
+        task.cancel()
+    try:
+        if tasks:
+            loop.run_until_complete(gather(*tasks, return_exceptions=True))
+    except SimulationEnd:
+        pass
+    finally:
+        _asyncio.set_event_loop(None)
+        loop.close()
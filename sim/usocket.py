@@ -0,0 +1,184 @@
+# ---- Simulated TCP socket ----
+# Enough of MicroPython's `socket` for umqtt: a stream to the board's broker.
+# Each write() call costs `board.sock_write_us` of blocking time plus
+# `board.sock_byte_us` per byte; bytes from the broker arrive
+# `broker.deliver_us` after they were sent. Any operation while Wi-Fi is
+# down fails with EHOSTUNREACH and breaks the connection, like lwIP does.
+# On a board with blocking=False, calls that would block take no virtual
+# time: a blocking read that has to wait takes the next bytes early.
+#
+# A board with a `broker_addr` talks real TCP to that address instead (e.g.
+# sim/mqttd.py): bytes go out as written and whatever has arrived is read,
+# so this path runs on host time and is not repeatable.
+
+import select
+import socket as _socket
+
+from sim import board as _board
+
+AF_INET = 2
+SOCK_STREAM = 1
+
+EHOSTUNREACH = 113
+ECONNRESET = 104
+ETIMEDOUT = 110
+
+TCP_WAIT_S = 5.0
+
+
+def getaddrinfo(host, port, af=0, type=0, proto=0, flags=0):
+    return [(AF_INET, SOCK_STREAM, 6, '', (host, port))]
+
+
+class _TcpConn:
+    # A real connection behind the same interface as broker.Connection:
+    # feed() sends, and poll() hands what arrived to `deliver`.
+    def __init__(self, addr, deliver):
+        self.sock = _socket.create_connection(addr, timeout=TCP_WAIT_S)
+        self.deliver = deliver
+        self.closed = False
+
+    def feed(self, data):
+        try:
+            self.sock.sendall(data)
+        except OSError:
+            self.close()
+            raise OSError(ECONNRESET)
+
+    def poll(self, timeout=0):
+        if self.closed:
+            return False
+        ready, _, _ = select.select([self.sock], [], [], timeout)
+        if not ready:
+            return False
+        try:
+            data = self.sock.recv(4096)
+        except OSError:
+            data = b''
+        if not data:
+            self.close()
+            return False
+        self.deliver(data)
+        return True
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.sock.close()
+
+
+class socket:
+    def __init__(self, af=AF_INET, type=SOCK_STREAM, proto=0):
+        self._board = _board.current()
+        self._conn = None
+        self._inbound = []
+        self._rx = bytearray()
+        self._blocking = True
+        self._timeout = None
+        self._broken = False
+        self._tcp = False
+
+    def _check(self):
+        if self._broken or self._conn is None or self._conn.closed:
+            raise OSError(ECONNRESET)
+        if not self._board.wifi.is_up():
+            self._fail()
+            raise OSError(EHOSTUNREACH)
+
+    def _fail(self):
+        self._broken = True
+        if self._conn is not None:
+            self._conn.close()
+
+    def _from_broker(self, data):
+        due = self._board.clock.now_us + self._board.broker.deliver_us
+        self._inbound.append((due, data))
+
+    def _from_tcp(self, data):
+        self._inbound.append((self._board.clock.now_us, data))
+
+    def _pull(self, early=False):
+        if self._tcp:
+            while self._conn.poll(0):
+                pass
+        now = self._board.clock.now_us
+        while self._inbound and early:
+            now = self._inbound[0][0]
+            early = False
+        while self._inbound and self._inbound[0][0] <= now:
+            _, data = self._inbound.pop(0)
+            if data[0] & 0xF0 == 0x30:
+                self._board.trace('receive', data)
+            self._rx += data
+
+    def connect(self, addr):
+        board = self._board
+        if not board.wifi.is_up():
+            raise OSError(EHOSTUNREACH)
+        if board.broker_addr is not None:
+            self._conn = _TcpConn(board.broker_addr, self._from_tcp)
+            self._tcp = True
+            board.trace('sock_connect')
+            return
+        # SYN / SYN-ACK round trip.
+        if board.blocking:
+            board.clock.advance(2 * board.broker.deliver_us)
+        self._conn = board.broker.open(self._from_broker, board)
+        board.trace('sock_connect')
+
+    def write(self, buf, n=None):
+        self._check()
+        data = bytes(buf if n is None else buf[:n])
+        board = self._board
+        board.sock_writes += 1
+        board.sock_bytes += len(data)
+        if board.blocking:
+            board.clock.advance(board.sock_write_us + board.sock_byte_us * len(data))
+        self._check()
+        self._conn.feed(data)
+        return len(data)
+
+    send = write
+
+    def read(self, n):
+        self._check()
+        self._pull()
+        if not self._blocking and not self._rx:
+            return None
+        board = self._board
+        while len(self._rx) < n and self._blocking:
+            if not self._inbound and self._tcp:
+                if self._conn.poll(self._timeout or TCP_WAIT_S):
+                    self._pull()
+                    continue
+                self._check()
+                raise OSError(ETIMEDOUT)
+            if not self._inbound:
+                # Nothing on the way: give up after the timeout, or at once
+                # where a real socket would wait forever.
+                if self._timeout and board.blocking:
+                    board.clock.advance(self._timeout * 1000000)
+                raise OSError(ETIMEDOUT)
+            if board.blocking:
+                board.clock.advance_to(self._inbound[0][0])
+            self._check()
+            self._pull(early=not board.blocking)
+        data = bytes(self._rx[:n])
+        del self._rx[:n]
+        return data
+
+    recv = read
+
+    def setblocking(self, flag):
+        # Same as settimeout(None) or settimeout(0), as on the board.
+        self._blocking = bool(flag)
+        self._timeout = None if flag else 0
+
+    def settimeout(self, seconds):
+        self._timeout = seconds
+        self._blocking = seconds is None or seconds > 0
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+        self._broken = True
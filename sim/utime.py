@@ -0,0 +1,52 @@
+# ---- MicroPython `time` stand-in ----
+# Mirrors the ESP32 port: ticks wrap at 2**30 and sleeps advance the shared
+# virtual clock rather than blocking the host.
+
+from sim import clock as _clock
+
+_TICKS_PERIOD = 1 << 30
+_TICKS_MAX = _TICKS_PERIOD - 1
+_TICKS_HALF = _TICKS_PERIOD // 2
+
+# Seconds between the MicroPython epoch (2000-01-01) and the simulated boot.
+_BOOT_EPOCH_S = 820454400
+
+
+def ticks_us():
+    return _clock.get().now_us & _TICKS_MAX
+
+
+def ticks_ms():
+    return (_clock.get().now_us // 1000) & _TICKS_MAX
+
+
+def ticks_cpu():
+    return ticks_us()
+
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) & _TICKS_MAX
+
+
+def ticks_diff(end, start):
+    return ((end - start + _TICKS_HALF) & _TICKS_MAX) - _TICKS_HALF
+
+
+def sleep(seconds):
+    _clock.get().advance(seconds * 1000000)
+
+
+def sleep_ms(ms):
+    _clock.get().advance(ms * 1000)
+
+
+def sleep_us(us):
+    _clock.get().advance(us)
+
+
+def time():
+    return _BOOT_EPOCH_S + _clock.get().now_us // 1000000
+
+
+def time_ns():
+    return (_BOOT_EPOCH_S * 1000000 + _clock.get().now_us) * 1000
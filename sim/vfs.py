@@ -0,0 +1,63 @@
+# ---- Per-board Filesystem ----
+# While the simulator is installed, relative paths given to open() and to
+# the os functions the firmware uses resolve inside the current board's
+# fs_dir. Absolute paths are left alone, so host code keeps working. Each
+# simulated board gets its own flash even when many share a process.
+
+import builtins
+import os
+
+from sim import board as _board
+
+_real_open = builtins.open
+_PATCHED = ('rename', 'remove', 'stat', 'listdir', 'mkdir', 'rmdir')
+_real = {name: getattr(os, name) for name in _PATCHED}
+
+
+def _resolve(path):
+    if isinstance(path, int):
+        return path
+    path = os.fspath(path)
+    if os.path.isabs(path):
+        return path
+    return os.path.join(_board.current().fs_dir, path)
+
+
+def open(file, *args, **kwargs):
+    return _real_open(_resolve(file), *args, **kwargs)
+
+
+def rename(src, dst):
+    return _real['rename'](_resolve(src), _resolve(dst))
+
+
+def remove(path):
+    return _real['remove'](_resolve(path))
+
+
+def stat(path):
+    return _real['stat'](_resolve(path))
+
+
+def listdir(path='.'):
+    return _real['listdir'](_resolve(path))
+
+
+def mkdir(path, *args):
+    return _real['mkdir'](_resolve(path), *args)
+
+
+def rmdir(path):
+    return _real['rmdir'](_resolve(path))
+
+
+def install():
+    builtins.open = open
+    for name in _PATCHED:
+        setattr(os, name, globals()[name])
+
+
+def uninstall():
+    builtins.open = _real_open
+    for name in _PATCHED:
+        setattr(os, name, _real[name])
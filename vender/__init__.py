@@ -0,0 +1,2 @@
+# ---- Vending Machine Firmware Modules ----
+# Copy this folder to the board next to main.py.
@@ -0,0 +1,65 @@
+# ---- Broker Selection ----
+# The brokers to try, in order of preference, as (host, port) pairs. A
+# broker.cfg file on flash overrides the built-in list, one "host port"
+# per line (port defaults to 1883, '#' starts a comment), so a board can be
+# pointed at a broker on the bench (python -m sim.mqttd) without editing
+# the firmware:
+#
+#   192.168.1.20 1883
+#   broker.hivemq.com
+#
+# Lines that don't parse (a port that isn't a number) are skipped and
+# counted in `skipped`; with no good line left the built-in list stays.
+#
+# After FAILOVER failed connects in a row, connects move on to the next
+# broker in the list, wrapping around at the end.
+
+PORT = 1883
+FAILOVER = 3
+
+
+class BrokerList:
+    def __init__(self, brokers, path="broker.cfg", failover=FAILOVER):
+        self.brokers = list(brokers)
+        self.failover = failover
+        self.index = 0
+        self.failures = 0
+        self.switches = 0
+        self.skipped = 0
+        self.load(path)
+
+    def load(self, path):
+        try:
+            with open(path) as f:
+                lines = f.read().split("\n")
+        except OSError:
+            return False
+        brokers = []
+        for line in lines:
+            words = line.split("#", 1)[0].split()
+            if not words:
+                continue
+            try:
+                port = int(words[1]) if len(words) > 1 else PORT
+            except ValueError:
+                self.skipped += 1
+                continue
+            brokers.append((words[0], port))
+        if not brokers:
+            return False
+        self.brokers = brokers
+        self.index = 0
+        return True
+
+    def current(self):
+        return self.brokers[self.index]
+
+    def connected(self):
+        self.failures = 0
+
+    def failed(self):
+        self.failures += 1
+        if self.failures >= self.failover and len(self.brokers) > 1:
+            self.failures = 0
+            self.index = (self.index + 1) % len(self.brokers)
+            self.switches += 1
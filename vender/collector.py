@@ -0,0 +1,76 @@
+# ---- Scheduled Garbage Collection ----
+# MicroPython collects when an allocation finds the heap full, which can be
+# in the middle of a vend or a key scan and takes a few ms on an ESP32. The
+# hot paths allocate next to nothing (key actions are ints, count payloads
+# and display lines are cached), so the little garbage there is can be
+# collected on our own schedule: run() checks every INTERVAL_MS and
+# collects once at least MIN_GARBAGE bytes have been allocated and idle()
+# says nothing is going on (no vend queued or moving, no key down). If the
+# machine never goes idle it collects anyway after MAX_WAIT_MS.
+#
+# Every pause goes into the "gc" timer of the metrics, "gc_forced" counts
+# collections that couldn't wait for idle, and the "heap_free" and
+# "garbage" gauges give the free heap and the bytes allocated between the
+# last two collections (0 when the steady state allocates nothing).
+
+import gc
+import time
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+INTERVAL_MS = 1000
+MAX_WAIT_MS = 30000
+MIN_GARBAGE = 4096
+
+
+class Collector:
+    def __init__(self, metrics=None, idle=None, min_garbage=MIN_GARBAGE,
+                 max_wait_ms=MAX_WAIT_MS):
+        self.metrics = metrics
+        self.idle = idle
+        self.min_garbage = min_garbage
+        self.max_wait_ms = max_wait_ms
+        self.collections = 0
+        self.garbage = 0
+        self.after = 0
+        self.last = time.ticks_ms()
+        if metrics is not None:
+            metrics.gauge("heap_free", gc.mem_free)
+            metrics.gauge("garbage", lambda: self.garbage)
+
+    def collect(self):
+        self.garbage = gc.mem_alloc() - self.after
+        started = time.ticks_us()
+        gc.collect()
+        pause = time.ticks_diff(time.ticks_us(), started)
+        self.after = gc.mem_alloc()
+        self.last = time.ticks_ms()
+        self.collections += 1
+        if self.metrics is not None:
+            self.metrics.record("gc", pause)
+        return pause
+
+    def due(self):
+        # "idle", "forced" or None.
+        waited = time.ticks_diff(time.ticks_ms(), self.last)
+        if waited >= self.max_wait_ms:
+            return "forced"
+        if gc.mem_alloc() - self.after < self.min_garbage:
+            return None
+        if self.idle is None or self.idle():
+            return "idle"
+        return None
+
+    async def run(self, interval_ms=INTERVAL_MS):
+        self.collect()
+        while True:
+            await asyncio.sleep_ms(interval_ms)
+            why = self.due()
+            if why is None:
+                continue
+            if why == "forced" and self.metrics is not None:
+                self.metrics.count("gc_forced")
+            self.collect()
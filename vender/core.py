@@ -0,0 +1,393 @@
+# ---- Vending Machine Core ----
+# The vending logic without any hardware: inventory, vend sequencing, key
+# handling and MQTT commands (protocol.py). Everything it drives is passed in:
+#
+#   draw(line1, line2)  puts the two message lines on the screen
+#   servos              one ServoMotion (anything with dispense()) per slot
+#   publisher           queues MQTT messages: event(), set_status()
+#   journal             records loads and vends to flash, or None
+#   metrics             a Metrics for counters and vend timing, or None
+#   log                 the Log to write to (a private one if None)
+#
+# The board script builds the drivers and wires them up; the simulator
+# and host benchmarks can use the same class with stand-ins.
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+from vender import journal as jr
+from vender import keypad as kp
+from vender import protocol as pr
+from vender import vendqueue as vq
+from vender.dedupe import Recent
+from vender.log import Log
+
+JOURNAL_SYNC_MS = 2000
+METRICS_MS = 60000
+
+# What a key does, looked up by keypad key index (see key_actions()):
+# nothing, load the selected slot, vend it again, or KEY_SLOT + n to
+# select and vend slot n.
+KEY_NONE = 0
+KEY_LOAD = 1
+KEY_AGAIN = 2
+KEY_SLOT = 16
+
+# Cached display lines (see line()).
+LINE_LEFT = 0
+LINE_COUNT = 1
+LINE_EMPTY = 2
+
+
+class VendingMachine:
+    def __init__(self, inventory, servos, publisher, draw, journal=None,
+                 metrics=None, log=None):
+        self.inventory = inventory
+        self.servos = servos
+        self.publisher = publisher
+        self.draw = draw
+        self.journal = journal
+        self.metrics = metrics
+        self.log = log if log is not None else Log()
+        self.vend_started = 0
+        self.selected = 0
+        # Command ids seen lately, so a redelivered command isn't run twice.
+        self.recent = Recent()
+        # Vends waiting for the servo, as (slot, Request or None). While the
+        # remote side is full, <root>queue says "busy" until half of it
+        # has drained again.
+        self.queue = vq.VendQueue()
+        self.busy = False
+        self.display_lines = None
+        self.lines = {}
+        # True while the arm is moving.
+        self.dispensing = False
+        # Called with the slot each time the arm starts moving.
+        self.on_vend = None
+        # Created by start(), once there is an event loop.
+        self.display_flag = None
+        self.vend_flag = None
+        self.servo_done = None
+
+    # ---- Display ----
+    # Once the scheduler runs, display() only records the latest text and
+    # display_task() draws it, so a burst of updates costs one redraw.
+    def display(self, line1, line2):
+        self.display_lines = (line1, line2)
+        if self.display_flag is None:
+            self.draw(line1, line2)
+        else:
+            self.display_flag.set()
+
+    def line(self, kind, slot, count=0):
+        # "Slot 1 Left: 3" and friends, formatted once per slot and count.
+        key = kind << 16 | slot << 8 | count
+        text = self.lines.get(key)
+        if text is None:
+            if kind == LINE_LEFT:
+                text = "Slot %d Left: %d" % (slot + 1, count)
+            elif kind == LINE_COUNT:
+                text = "Slot %d Count: %d" % (slot + 1, count)
+            else:
+                text = "Slot %d Empty!" % (slot + 1)
+            self.lines[key] = text
+        return text
+
+    def publish_status(self, slot, state=None):
+        inv = self.inventory
+        self.publisher.set_status(inv.status_topics[slot], inv.count(slot), state)
+
+    def _count(self, name):
+        if self.metrics is not None:
+            self.metrics.count(name)
+
+    def _record(self, kind, slot):
+        if self.journal is not None:
+            self.journal.record(kind, slot, self.inventory.count(slot))
+
+    # ---- Vending ----
+    # vend() only queues the request (vendqueue.py); servo_task() is the one
+    # executor: it starts the motion and finishes the vend when the servo
+    # reports it is done, so keys and MQTT keep being serviced while the arm
+    # moves. A full queue turns keypad vends away with "Busy" on the screen
+    # and remote ones with "err busy".
+    def vend(self, slot=0, request=None, source=vq.LOCAL):
+        self.log.info("Vend queued, slot %d count = %d", slot + 1, self.inventory.count(slot))
+        if not self.queue.put(slot, request, source):
+            self.log.warn("Vend queue full, slot %d", slot + 1)
+            self._count("busy")
+            if source == vq.LOCAL:
+                self.display("Busy", "Try again")
+            self._queue_changed()
+            return False
+        self._queue_changed()
+        if self.vend_flag is not None:
+            self.vend_flag.set()
+        return True
+
+    def _queue_changed(self):
+        queue = self.queue
+        if self.busy:
+            busy = queue.depth(vq.REMOTE) > queue.rings[vq.REMOTE].size // 2
+        else:
+            busy = queue.space(vq.REMOTE) == 0
+        if busy != self.busy:
+            self.busy = busy
+            self.publisher.set_status(self.inventory.queue_topic, len(queue),
+                                      pr.BUSY if busy else pr.READY)
+
+    def start_vend(self, slot, request=None):
+        inv = self.inventory
+        if inv.is_empty(slot):
+            self.log.info("No snack loaded, slot %d", slot + 1)
+            self.publisher.event(inv.event_topics[slot], b"vend_attempt_empty")
+            self.display("EMPTY", "Load snack (A)")
+            self._count("empty")
+            self._vended(request, pr.EMPTY, False)
+            return False
+
+        self.log.info("Vending slot %d", slot + 1)
+        self.publisher.event(inv.event_topics[slot], b"vend_start")
+        if self.metrics is not None:
+            self.vend_started = self.metrics.start()
+        self.servos[slot].dispense(self.servo_done.set)
+        if self.on_vend is not None:
+            self.on_vend(slot)
+        return True
+
+    def finish_vend(self, slot, request=None):
+        inv = self.inventory
+        inv.take(slot)
+        self._record(jr.VEND, slot)
+        if self.metrics is not None:
+            self.metrics.count("vends")
+            self.metrics.stop("vend", self.vend_started)
+        self.log.info("After vend, slot %d count = %d", slot + 1, inv.count(slot))
+        self._vended(request, inv.count(slot))
+        if not inv.is_empty(slot):
+            self.publish_status(slot, b"loaded")
+            self.display("Vended!", self.line(LINE_LEFT, slot, inv.count(slot)))
+        else:
+            self.publish_status(slot, b"empty")
+            self.display(self.line(LINE_EMPTY, slot), "Load snack")
+
+    def _vended(self, request, value, ok=True):
+        if request is not None and request.done(value, ok):
+            self.reply(request.cid, pr.OK if request.ok else pr.ERR, request.results)
+
+    def load(self, slot):
+        inv = self.inventory
+        if inv.load(slot):
+            self._record(jr.LOAD, slot)
+            self.log.info("Snack loaded, slot %d count = %d", slot + 1, inv.count(slot))
+            self.publish_status(slot, b"load_snack")
+            self.display("Snack Loaded", self.line(LINE_COUNT, slot, inv.count(slot)))
+            return True
+        self.log.info("Slot %d already full", slot + 1)
+        self.display("Slot Full", self.line(LINE_COUNT, slot, inv.count(slot)))
+        return False
+
+    def idle(self):
+        # Nothing queued, moving or waiting to be drawn or sent.
+        return (not self.dispensing and not len(self.queue)
+                and not (self.display_flag is not None and self.display_flag.is_set())
+                and not self.publisher.pending())
+
+    # ---- Input ----
+    # A slot key vends from that slot and selects it, # vends the selected
+    # slot again and A loads one snack into the selected slot. key_task()
+    # works on key indexes: key_actions() turns the keypad's key names into
+    # one action byte per index up front.
+    def key_action(self, key):
+        if key == "A":
+            return KEY_LOAD
+        if key == "#":
+            return KEY_AGAIN
+        slot = self.inventory.slot_for_key(key)
+        return KEY_SLOT + slot if slot >= 0 else KEY_NONE
+
+    def key_actions(self, keys):
+        return bytearray(self.key_action(key) for key in keys)
+
+    def handle_key(self, key):
+        self.log.debug("Key pressed: %s", key)
+        self.do_key(self.key_action(key))
+
+    def do_key(self, action):
+        if action == KEY_LOAD:
+            self.load(self.selected)
+        elif action == KEY_AGAIN:
+            self.log.info("Vend requested from keypad, slot %d", self.selected + 1)
+            self.vend(self.selected)
+        elif action >= KEY_SLOT:
+            slot = action - KEY_SLOT
+            self.selected = slot
+            self.log.info("Vend requested from keypad, slot %d", slot + 1)
+            self.vend(slot)
+
+    def on_message(self, topic, msg):
+        self.log.debug("Got message: %s %s", topic, msg)
+        slot = self.inventory.slot_for_topic(topic)
+        if slot >= 0 and msg == b"vend":
+            self.log.info("Remote vend requested, slot %d", slot + 1)
+            self.vend(slot, None, vq.REMOTE)
+            return
+        command = pr.parse(msg)
+        if command is None:
+            self.log.warn("Bad command: %s", msg)
+            return
+        cid, verb, args = command
+        if self.recent.seen(cid):
+            # Already run (or running): answer again with the last reply.
+            self.log.info("Duplicate command: %s", cid)
+            cached = self.recent.reply(cid)
+            if cached is not None:
+                self.publisher.event(self.inventory.reply_topic, cached)
+            return
+        if args is None:
+            self.reply(cid, pr.ERR, (pr.BAD_ARGS,))
+            return
+        # On a slot's own topic that slot is implied.
+        if slot >= 0 and (verb == pr.LOAD or verb == pr.SET_CAPACITY
+                          or verb == pr.VEND and not args):
+            args.insert(0, slot + 1)
+        self.command(cid, verb, args)
+
+    def reply(self, cid, status, values=()):
+        msg = pr.reply(cid, status, values)
+        self.recent.store(cid, msg)
+        self.publisher.event(self.inventory.reply_topic, msg)
+
+    def command(self, cid, verb, args):
+        inv = self.inventory
+        # Slot numbers: every argument of vend, the first of load and
+        # set_capacity.
+        if verb == pr.VEND:
+            slots = len(args)
+        elif verb == pr.LOAD or verb == pr.SET_CAPACITY:
+            slots = min(len(args), 1)
+        else:
+            slots = 0
+        for i in range(slots):
+            if not 1 <= args[i] <= inv.size:
+                self.reply(cid, pr.ERR, (pr.BAD_SLOT,))
+                return
+        if verb == pr.VEND:
+            # A batch bigger than the whole queue could never be taken.
+            if not args or len(args) > self.queue.rings[vq.REMOTE].size:
+                self.reply(cid, pr.ERR, (pr.BAD_ARGS,))
+                return
+            # A batch is queued whole or not at all.
+            if self.queue.space(vq.REMOTE) < len(args):
+                self.queue.rejected[vq.REMOTE] += 1
+                self._count("busy")
+                self.reply(cid, pr.ERR, (pr.BUSY, len(self.queue)))
+                return
+            self.log.info("Remote vend requested, slots %s", args)
+            request = pr.Request(cid, len(args))
+            for n in args:
+                self.vend(n - 1, request, vq.REMOTE)
+            self.reply(cid, pr.ACK)
+        elif verb == pr.LOAD:
+            if not 1 <= len(args) <= 2:
+                self.reply(cid, pr.ERR, (pr.BAD_ARGS,))
+                return
+            slot = args[0] - 1
+            for _ in range(args[1] if len(args) == 2 else 1):
+                if not self.load(slot):
+                    self.reply(cid, pr.ERR, (pr.FULL, inv.count(slot)))
+                    return
+            self.reply(cid, pr.OK, (inv.count(slot),))
+        elif verb == pr.STATUS:
+            self.reply(cid, pr.OK, [b"%d/%d" % (inv.count(i), inv.capacity[i])
+                                    for i in range(inv.size)])
+        elif verb == pr.LOG:
+            if len(args) != 1 or not 0 <= args[0] <= 4:
+                self.reply(cid, pr.ERR, (pr.BAD_ARGS,))
+                return
+            self.log.set_level(args[0])
+            self.reply(cid, pr.OK)
+        elif verb == pr.METRICS:
+            report = self.metrics.report() if self.metrics is not None else b""
+            self.reply(cid, pr.OK, (report,) if report else ())
+        elif verb == pr.SET_CAPACITY:
+            if len(args) != 2 or not 0 <= args[1] <= 255:
+                self.reply(cid, pr.ERR, (pr.BAD_ARGS,))
+                return
+            slot = args[0] - 1
+            before = inv.count(slot)
+            inv.set_capacity(slot, args[1])
+            if inv.count(slot) != before:
+                self._record(jr.SET, slot)
+                self.publish_status(slot)
+            self.reply(cid, pr.OK, (inv.count(slot),))
+        else:
+            self.reply(cid, pr.ERR, (pr.UNKNOWN,))
+
+    # ---- Tasks ----
+    def start(self):
+        self.display_flag = asyncio.Event()
+        self.vend_flag = asyncio.Event()
+        self.servo_done = asyncio.ThreadSafeFlag()
+        if len(self.queue):
+            self.vend_flag.set()
+
+    # Holding A keeps loading, one snack per repeat.
+    async def key_task(self, keypad):
+        actions = self.key_actions(keypad.keys)
+        while True:
+            await keypad.ready.wait()
+            keypad.ready.clear()
+            event = keypad.get()
+            while event >= 0:
+                kind = event >> 4
+                action = actions[event & 0x0F]
+                if kind == kp.DOWN or (kind == kp.REPEAT and action == KEY_LOAD):
+                    self.do_key(action)
+                event = keypad.get()
+
+    async def display_task(self):
+        while True:
+            await self.display_flag.wait()
+            self.display_flag.clear()
+            self.draw(*self.display_lines)
+
+    async def servo_task(self):
+        while True:
+            await self.vend_flag.wait()
+            self.vend_flag.clear()
+            item = self.queue.get()
+            while item is not None:
+                self._queue_changed()
+                slot, request = item
+                if self.start_vend(slot, request):
+                    self.dispensing = True
+                    await self.servo_done.wait()
+                    self.dispensing = False
+                    self.finish_vend(slot, request)
+                item = self.queue.get()
+
+    async def journal_task(self, interval_ms=JOURNAL_SYNC_MS):
+        while True:
+            await asyncio.sleep_ms(interval_ms)
+            self.journal.sync(self.inventory.counts)
+
+    async def metrics_task(self, interval_ms=METRICS_MS):
+        while True:
+            await asyncio.sleep_ms(interval_ms)
+            if self.metrics.enabled:
+                self.publisher.event(self.inventory.metrics_topic, self.metrics.report())
+
+    def tasks(self, keypad=None):
+        # Coroutines for the scheduler; start() must have been called.
+        tasks = [self.display_task(), self.servo_task()]
+        if keypad is not None:
+            tasks.append(self.key_task(keypad))
+        if self.journal is not None:
+            tasks.append(self.journal_task())
+        if self.metrics is not None:
+            tasks.append(self.metrics_task())
+        tasks.append(self.log.run())
+        return tasks
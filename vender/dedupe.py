@@ -0,0 +1,59 @@
+# ---- Recent Command Cache ----
+# Remembers the last `size` command ids for `ttl_ms`, together with the
+# latest reply sent for each, so a command that arrives twice (a broker
+# redelivery, or a backend retrying after a lost reply) is answered again
+# instead of being run again. Slots are reused in arrival order, so memory
+# stays fixed however many commands come in; an expired id is forgotten
+# and would run again.
+
+import time
+
+SIZE = 16
+TTL_MS = 60000
+
+
+class Recent:
+    def __init__(self, size=SIZE, ttl_ms=TTL_MS):
+        self.size = size
+        self.ttl_ms = ttl_ms
+        self.ids = [None] * size
+        self.replies = [None] * size
+        self.stamps = [0] * size
+        self.index = {}
+        self.next = 0
+        self.hits = 0
+
+    def _find(self, cid):
+        i = self.index.get(cid, -1)
+        if i >= 0 and time.ticks_diff(time.ticks_ms(), self.stamps[i]) > self.ttl_ms:
+            del self.index[cid]
+            self.ids[i] = None
+            self.replies[i] = None
+            return -1
+        return i
+
+    def seen(self, cid):
+        # True (and counted) if cid is already known; otherwise it is
+        # remembered from now on.
+        if self._find(cid) >= 0:
+            self.hits += 1
+            return True
+        i = self.next
+        self.next = (i + 1) % self.size
+        old = self.ids[i]
+        if old is not None:
+            del self.index[old]
+        self.ids[i] = cid
+        self.replies[i] = None
+        self.stamps[i] = time.ticks_ms()
+        self.index[cid] = i
+        return False
+
+    def store(self, cid, reply):
+        i = self.index.get(cid, -1)
+        if i >= 0:
+            self.replies[i] = reply
+
+    def reply(self, cid):
+        i = self._find(cid)
+        return self.replies[i] if i >= 0 else None
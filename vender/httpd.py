@@ -0,0 +1,221 @@
+# ---- Local HTTP Endpoint ----
+# A small HTTP/1.1 server on the machine itself, so tools on the same
+# network can read and drive it directly instead of through the public MQTT
+# broker. It works on the same VendingMachine as the keypad and MQTT:
+#
+#   GET  /status         {"slots": [{"slot": 1, "count": 2, "capacity": 5}],
+#                         "queue": 0, "busy": false}
+#   POST /vend?slot=1    202 once the vend is queued (same queue as remote
+#                        commands), 503 while that queue is full
+#   POST /load?slot=1    200 with the new count, 409 if the slot is full
+#   GET  /metrics        the metrics report, one name=value per line
+#
+# Connections stay open between requests (keep-alive) until the client
+# closes, sends "Connection: close" or is idle for IDLE_MS; a request whose
+# headers or body stall for IDLE_MS ends the connection too. At most
+# MAX_CLIENTS are served at once; more are answered 503 and closed. With a
+# token set, every request needs "Authorization: Bearer <token>".
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+from vender import vendqueue as vq
+
+PORT = 80
+IDLE_MS = 5000
+MAX_CLIENTS = 4
+MAX_BODY = 256
+MAX_HEADERS = 32
+
+REASONS = {
+    200: b"OK",
+    202: b"Accepted",
+    400: b"Bad Request",
+    401: b"Unauthorized",
+    404: b"Not Found",
+    405: b"Method Not Allowed",
+    409: b"Conflict",
+    413: b"Payload Too Large",
+    503: b"Service Unavailable",
+}
+
+JSON = b"application/json"
+TEXT = b"text/plain"
+
+
+class HttpServer:
+    def __init__(self, vending, metrics=None, port=PORT, token=None, log=None):
+        self.vending = vending
+        self.metrics = metrics
+        self.port = port
+        self.auth = None if token is None else b"Bearer " + token.encode()
+        self.log = log if log is not None else vending.log
+        self.server = None
+        self.clients = 0
+        self.requests = 0
+        self.refused = 0
+
+    async def run(self, host="0.0.0.0"):
+        try:
+            self.server = await asyncio.start_server(self._serve, host, self.port)
+        except OSError as e:
+            self.log.warn("HTTP server not started: %s", e)
+            return
+        self.log.info("HTTP server on port %d", self.port)
+
+    # ---- Connections ----
+    async def _serve(self, reader, writer):
+        if self.clients >= MAX_CLIENTS:
+            self.refused += 1
+            await self._respond(writer, 503, TEXT, b"busy\n", False)
+            await self._close(writer)
+            return
+        self.clients += 1
+        try:
+            keep = True
+            while keep:
+                try:
+                    line = await asyncio.wait_for_ms(reader.readline(), IDLE_MS)
+                except asyncio.TimeoutError:
+                    break
+                if not line:
+                    break
+                keep = await self._request(line, reader, writer)
+        except (OSError, EOFError, asyncio.TimeoutError):
+            # Reset, closed mid-request, or stalled in the headers or body.
+            pass
+        finally:
+            self.clients -= 1
+            await self._close(writer)
+
+    async def _close(self, writer):
+        try:
+            writer.close()
+            await writer.wait_closed()
+        except OSError:
+            pass
+
+    async def _request(self, line, reader, writer):
+        # One request on the connection; returns whether to keep it open.
+        parts = line.split()
+        if len(parts) != 3:
+            await self._respond(writer, 400, TEXT, b"bad request\n", False)
+            return False
+        method, target, version = parts
+        keep = version == b"HTTP/1.1"
+        length = 0
+        authorized = self.auth is None
+        for _ in range(MAX_HEADERS):
+            header = await asyncio.wait_for_ms(reader.readline(), IDLE_MS)
+            if header in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = header.partition(b":")
+            name = name.strip().lower()
+            value = value.strip()
+            if name == b"content-length":
+                try:
+                    length = int(value)
+                except ValueError:
+                    length = -1
+            elif name == b"connection":
+                value = value.lower()
+                if value == b"close":
+                    keep = False
+                elif value == b"keep-alive":
+                    keep = True
+            elif name == b"authorization" and value == self.auth:
+                authorized = True
+        else:
+            await self._respond(writer, 400, TEXT, b"too many headers\n", False)
+            return False
+        if not 0 <= length <= MAX_BODY:
+            await self._respond(writer, 413, TEXT, b"body too large\n", False)
+            return False
+        if length:
+            await asyncio.wait_for_ms(reader.readexactly(length), IDLE_MS)
+        self.requests += 1
+        if self.metrics is not None:
+            self.metrics.count("http")
+        if not authorized:
+            status, ctype, body = 401, TEXT, b"token required\n"
+        else:
+            path, _, query = target.partition(b"?")
+            status, ctype, body = self.handle(method, path, query)
+        self.log.debug("HTTP %s %s: %d", method, target, status)
+        await self._respond(writer, status, ctype, body, keep)
+        return keep
+
+    async def _respond(self, writer, status, ctype, body, keep):
+        writer.write(b"HTTP/1.1 %d %s\r\nContent-Type: %s\r\nContent-Length: %d\r\n"
+                     b"Connection: %s\r\n\r\n" % (status, REASONS[status], ctype, len(body),
+                                                 b"keep-alive" if keep else b"close"))
+        writer.write(body)
+        await writer.drain()
+
+    # ---- Endpoints ----
+    def handle(self, method, path, query):
+        # (status, content type, body) for one request.
+        if path == b"/status":
+            if method != b"GET":
+                return 405, TEXT, b"use GET\n"
+            return 200, JSON, self.status()
+        if path == b"/metrics":
+            if method != b"GET":
+                return 405, TEXT, b"use GET\n"
+            return 200, TEXT, self.report()
+        if path == b"/vend" or path == b"/load":
+            if method != b"POST":
+                return 405, TEXT, b"use POST\n"
+            slot = self._slot(query)
+            if slot < 0:
+                return 400, TEXT, b"slot must be 1..%d\n" % self.vending.inventory.size
+            if path == b"/vend":
+                return self.vend(slot)
+            return self.load(slot)
+        return 404, TEXT, b"not found\n"
+
+    def _slot(self, query):
+        for pair in query.split(b"&"):
+            name, _, value = pair.partition(b"=")
+            if name == b"slot":
+                try:
+                    slot = int(value) - 1
+                except ValueError:
+                    return -1
+                return slot if 0 <= slot < self.vending.inventory.size else -1
+        # Single-slot machines don't need to say which.
+        return 0 if self.vending.inventory.size == 1 else -1
+
+    def status(self):
+        vending = self.vending
+        inv = vending.inventory
+        slots = [{"slot": i + 1, "count": inv.count(i), "capacity": inv.capacity[i]}
+                 for i in range(inv.size)]
+        return json.dumps({"slots": slots, "queue": len(vending.queue),
+                           "busy": vending.busy}).encode()
+
+    def report(self):
+        if self.metrics is None:
+            return b""
+        return b"".join(name.encode() + b"=" + value + b"\n"
+                        for name, value in self.metrics.items())
+
+    def vend(self, slot):
+        vending = self.vending
+        self.log.info("HTTP vend requested, slot %d", slot + 1)
+        if not vending.vend(slot, None, vq.REMOTE):
+            return 503, JSON, json.dumps({"queued": False, "queue": len(vending.queue)}).encode()
+        return 202, JSON, json.dumps({"queued": True, "queue": len(vending.queue)}).encode()
+
+    def load(self, slot):
+        inv = self.vending.inventory
+        if not self.vending.load(slot):
+            return 409, JSON, json.dumps({"loaded": False, "count": inv.count(slot)}).encode()
+        return 200, JSON, json.dumps({"loaded": True, "count": inv.count(slot)}).encode()
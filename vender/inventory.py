@@ -0,0 +1,96 @@
+# ---- Slot Inventory ----
+# Counts, capacities and servo pins for every slot live in flat byte arrays
+# indexed by slot number (0-based). Keypad keys and MQTT command topics map
+# to a slot through dicts built once at start-up, so finding the slot for
+# an input is a single lookup however many slots the machine has.
+#
+# Slot n (0-based) publishes on <root>slot<n+1>/..., where the root is
+# b"vender/" unless set_root() changes it, matching the original single-slot
+# topics. Commands for the whole machine arrive on <root>command and are
+# answered on <root>reply (see protocol.py); <root>queue reports when the
+# vend queue is too full to take remote vends, <root>metrics carries the
+# periodic metrics report and <root>log warnings and errors. With binary
+# telemetry on (wire.py), slot status and events go out on <root>wire.
+
+from array import array
+
+TOPIC_ROOT = b"vender/"
+
+
+class Inventory:
+    def __init__(self, slots, root=TOPIC_ROOT):
+        # slots: sequence of (key, servo_pin, capacity, count)
+        n = len(slots)
+        self.size = n
+        self.counts = array('B', [0] * n)
+        self.capacity = array('B', [0] * n)
+        self.servo_pins = array('B', [0] * n)
+        self.keys = {}
+        for i, (key, pin, capacity, count) in enumerate(slots):
+            self.keys[key] = i
+            self.servo_pins[i] = pin
+            self.capacity[i] = capacity
+            self.counts[i] = min(count, capacity)
+        self.set_root(root)
+
+    def set_root(self, root):
+        self.command_topic = root + b"command"
+        self.reply_topic = root + b"reply"
+        self.queue_topic = root + b"queue"
+        self.metrics_topic = root + b"metrics"
+        self.log_topic = root + b"log"
+        self.wire_topic = root + b"wire"
+        self.status_topics = []
+        self.event_topics = []
+        self.command_topics = []
+        self.topic_slots = {}
+        self.report_slots = {}
+        for i in range(self.size):
+            base = root + b"slot" + str(i + 1).encode()
+            self.status_topics.append(base + b"/status")
+            self.event_topics.append(base + b"/event")
+            self.command_topics.append(base + b"/command")
+            self.topic_slots[self.command_topics[i]] = i
+            self.report_slots[self.status_topics[i]] = i
+            self.report_slots[self.event_topics[i]] = i
+
+    def slot_for_key(self, key):
+        return self.keys.get(key, -1)
+
+    def slot_for_topic(self, topic):
+        return self.topic_slots.get(topic, -1)
+
+    def count(self, slot):
+        return self.counts[slot]
+
+    def is_empty(self, slot):
+        return self.counts[slot] == 0
+
+    def is_full(self, slot):
+        return self.counts[slot] >= self.capacity[slot]
+
+    def load(self, slot):
+        if self.counts[slot] >= self.capacity[slot]:
+            return False
+        self.counts[slot] += 1
+        return True
+
+    def take(self, slot):
+        if self.counts[slot] == 0:
+            return False
+        self.counts[slot] -= 1
+        return True
+
+    def set_capacity(self, slot, capacity):
+        self.capacity[slot] = capacity
+        if self.counts[slot] > capacity:
+            self.counts[slot] = capacity
+
+    def clamp(self):
+        # After restoring saved counts against a possibly smaller capacity.
+        for i in range(self.size):
+            if self.counts[i] > self.capacity[i]:
+                self.counts[i] = self.capacity[i]
+
+    def total(self):
+        return sum(self.counts)
@@ -0,0 +1,170 @@
+# ---- Inventory Journal ----
+# Keeps slot counts across resets with two small files:
+#
+#   <path>.snap  magic, generation, slot count, one count byte per slot, check
+#   <path>.log   generation header, then 4-byte records (kind, slot, count, check)
+#
+# Records carry the count *after* the change, so restoring is "snapshot,
+# then the last record for each slot" and never needs more than one log's
+# worth of replay. Records are buffered in RAM and sync() appends them in
+# one write, so flash sees one small write every few seconds at most rather
+# than one per key press. Once the log holds `compact_every` records,
+# compact() writes a fresh snapshot under the next generation and starts an
+# empty log; a log whose header doesn't match the snapshot generation is
+# left over from before a compaction and is ignored. A torn record at the
+# end of the log (power lost mid-write) fails its check byte and ends the
+# replay; restore() then compacts straight away, since records appended
+# after it could never be read back.
+
+import os
+import struct
+
+LOAD = 1
+VEND = 2
+SET = 3
+
+RECORD = 4
+SNAP_MAGIC = b"VJS1"
+
+
+def _check(a, b, c):
+    return a ^ b ^ c ^ 0xA5
+
+
+class Journal:
+    def __init__(self, path="inventory", compact_every=256, buffer_records=32):
+        self.snap_path = path + ".snap"
+        self.log_path = path + ".log"
+        self.compact_every = compact_every
+        self.gen = 0
+        self.logged = 0
+        self.has_log = False
+        self.buf = bytearray(buffer_records * RECORD)
+        self.used = 0
+        self.syncs = 0
+        self.compactions = 0
+
+    # ---- Boot ----
+    def restore(self, counts):
+        # Fills `counts` in place; returns False if nothing was saved yet.
+        found = self._read_snapshot(counts)
+        self.logged = 0
+        self.has_log = False
+        torn = False
+        try:
+            with open(self.log_path, "rb") as f:
+                header = f.read(2)
+                if len(header) == 2 and struct.unpack("<H", header)[0] == self.gen:
+                    self.has_log = True
+                    while True:
+                        rec = f.read(RECORD)
+                        if len(rec) < RECORD or rec[3] != _check(rec[0], rec[1], rec[2]):
+                            torn = len(rec) > 0
+                            break
+                        if rec[1] < len(counts):
+                            counts[rec[1]] = rec[2]
+                        self.logged += 1
+                        found = True
+        except OSError:
+            pass
+        if torn and not self.compact(counts):
+            # Compact at the next sync() instead.
+            self.logged = self.compact_every
+        return found
+
+    def _read_snapshot(self, counts):
+        try:
+            with open(self.snap_path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return False
+        if len(data) < 8 or data[:4] != SNAP_MAGIC:
+            return False
+        gen, n = struct.unpack("<HB", data[4:7])
+        if len(data) != 8 + n:
+            return False
+        check = 0
+        for b in data[:-1]:
+            check ^= b
+        if check != data[-1]:
+            return False
+        self.gen = gen
+        for i in range(min(n, len(counts))):
+            counts[i] = data[7 + i]
+        return True
+
+    # ---- Recording ----
+    def record(self, kind, slot, count):
+        if self.used + RECORD > len(self.buf):
+            self.sync()
+        buf = self.buf
+        i = self.used
+        buf[i] = kind
+        buf[i + 1] = slot
+        buf[i + 2] = count
+        buf[i + 3] = _check(kind, slot, count)
+        self.used = i + RECORD
+
+    def dirty(self):
+        return self.used > 0
+
+    def sync(self, counts=None):
+        if not self.used:
+            return 0
+        n = self.used
+        try:
+            if self.has_log:
+                with open(self.log_path, "ab") as f:
+                    f.write(memoryview(self.buf)[:n])
+            else:
+                # No log for this generation yet (or a stale one): start it.
+                with open(self.log_path, "wb") as f:
+                    f.write(struct.pack("<H", self.gen))
+                    f.write(memoryview(self.buf)[:n])
+                self.has_log = True
+        except OSError:
+            return 0
+        self.used = 0
+        self.logged += n // RECORD
+        self.syncs += 1
+        if counts is not None and self.logged >= self.compact_every:
+            self.compact(counts)
+        return n
+
+    def compact(self, counts):
+        # Returns False, keeping the current generation and log, if the new
+        # snapshot can't be put in place; the next sync() tries again.
+        gen = (self.gen + 1) & 0xFFFF
+        data = bytearray(SNAP_MAGIC + struct.pack("<HB", gen, len(counts)))
+        data += bytes(counts)
+        check = 0
+        for b in data:
+            check ^= b
+        data.append(check)
+        tmp = self.snap_path + ".tmp"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(data)
+            # rename() replaces the old snapshot in one step on littlefs; FAT
+            # wants the target gone first.
+            try:
+                os.rename(tmp, self.snap_path)
+            except OSError:
+                os.remove(self.snap_path)
+                os.rename(tmp, self.snap_path)
+        except OSError:
+            return False
+        self.gen = gen
+        self.logged = 0
+        # Anything still buffered is already in the snapshot.
+        self.used = 0
+        self.compactions += 1
+        # The old log is stale now; if the new one can't be started here,
+        # the next sync() starts it.
+        try:
+            with open(self.log_path, "wb") as f:
+                f.write(struct.pack("<H", gen))
+            self.has_log = True
+        except OSError:
+            self.has_log = False
+        return True
@@ -0,0 +1,154 @@
+# ---- Interrupt-driven Keypad ----
+# While idle all rows are held low and every column has a falling-edge
+# interrupt, so a press on any key wakes the scanner; nothing is polled
+# until then. While keys are down the whole matrix is scanned every
+# SCAN_MS into a 16-bit mask, and a change only counts once it has been
+# stable for DEBOUNCE_MS. Every key is tracked separately (rollover), and
+# held keys produce HOLD and then REPEAT events. Events are one byte,
+# (kind << 4) | key index, kept in a fixed ring buffer until read.
+
+import time
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+DOWN = 1
+UP = 2
+HOLD = 3
+REPEAT = 4
+
+SCAN_MS = 5
+DEBOUNCE_MS = 20
+HOLD_MS = 800
+REPEAT_MS = 250
+
+
+class Keypad:
+    def __init__(self, rows, cols, keymap, size=32):
+        self.rows = rows
+        self.cols = cols
+        self.keys = [key for row in keymap for key in row]
+        self.events = bytearray(size)
+        self.head = 0
+        self.tail = 0
+        self.dropped = 0
+        self.raw = 0
+        self.stable = 0
+        self.changed_at = 0
+        self.held = 0
+        self.down_at = [0] * len(self.keys)
+        self.next_repeat = [0] * len(self.keys)
+        self.wake = asyncio.ThreadSafeFlag()
+        self.ready = asyncio.Event()
+
+    # ---- Ring buffer ----
+    def _push(self, kind, index):
+        nxt = (self.head + 1) % len(self.events)
+        if nxt == self.tail:
+            self.dropped += 1
+            return
+        self.events[self.head] = (kind << 4) | index
+        self.head = nxt
+        self.ready.set()
+
+    def get(self):
+        # Next event byte, or -1 when the buffer is empty.
+        if self.tail == self.head:
+            return -1
+        event = self.events[self.tail]
+        self.tail = (self.tail + 1) % len(self.events)
+        return event
+
+    def key(self, event):
+        return self.keys[event & 0x0F]
+
+    # ---- Interrupts ----
+    def _irq(self, pin):
+        self.wake.set()
+
+    def arm(self):
+        for r in self.rows:
+            r.value(0)
+        for c in self.cols:
+            c.irq(handler=self._irq, trigger=c.IRQ_FALLING)
+        # A key already down when we armed has no edge left to catch.
+        for c in self.cols:
+            if c.value() == 0:
+                self.wake.set()
+
+    def disarm(self):
+        for c in self.cols:
+            c.irq(handler=None)
+
+    # ---- Scanning ----
+    def scan(self):
+        mask = 0
+        bit = 1
+        rows = self.rows
+        cols = self.cols
+        for r in rows:
+            r.value(1)
+        for r in rows:
+            r.value(0)
+            for c in cols:
+                if c.value() == 0:
+                    mask |= bit
+                bit <<= 1
+            r.value(1)
+        return mask
+
+    def poll(self):
+        now = time.ticks_ms()
+        raw = self.scan()
+        if raw != self.raw:
+            self.raw = raw
+            self.changed_at = now
+        elif raw != self.stable and time.ticks_diff(now, self.changed_at) >= DEBOUNCE_MS:
+            self._update(raw, now)
+        if self.stable:
+            self._repeat(now)
+
+    def _update(self, mask, now):
+        changed = mask ^ self.stable
+        index = 0
+        while changed:
+            if changed & 1:
+                if mask >> index & 1:
+                    self.down_at[index] = now
+                    self._push(DOWN, index)
+                else:
+                    self.held &= ~(1 << index)
+                    self._push(UP, index)
+            changed >>= 1
+            index += 1
+        self.stable = mask
+
+    def _repeat(self, now):
+        mask = self.stable
+        index = 0
+        while mask:
+            if mask & 1:
+                bit = 1 << index
+                if not self.held & bit:
+                    if time.ticks_diff(now, self.down_at[index]) >= HOLD_MS:
+                        self.held |= bit
+                        self.next_repeat[index] = time.ticks_add(now, REPEAT_MS)
+                        self._push(HOLD, index)
+                elif time.ticks_diff(now, self.next_repeat[index]) >= 0:
+                    self.next_repeat[index] = time.ticks_add(now, REPEAT_MS)
+                    self._push(REPEAT, index)
+            mask >>= 1
+            index += 1
+
+    async def run(self):
+        while True:
+            self.arm()
+            await self.wake.wait()
+            self.disarm()
+            self.raw = self.scan()
+            self.changed_at = time.ticks_ms()
+            while self.raw or self.stable:
+                await asyncio.sleep_ms(SCAN_MS)
+                self.poll()
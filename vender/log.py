@@ -0,0 +1,112 @@
+# ---- Ring Buffer Log ----
+# print() to the UART blocks until the line is out (about 1 ms per dozen
+# characters at 115200 baud). Log calls instead store a record (ticks_ms,
+# level, format string, args) in a fixed ring; nothing is formatted until
+# run() drains the ring in the background, at most BATCH records every
+# INTERVAL_MS, to serial and (from publish_level up) to MQTT through
+# `publish(msg)`, if set. When the ring overflows the oldest records are
+# dropped and counted.
+#
+#   log.info("Key pressed: %s", key)
+#
+# Levels below `level` are skipped before anything is stored; set_level()
+# and enable() change that at runtime.
+
+from array import array
+import time
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+DEBUG = 0
+INFO = 1
+WARN = 2
+ERROR = 3
+
+LEVEL_NAMES = ("D", "I", "W", "E")
+
+SIZE = 64
+BATCH = 8
+INTERVAL_MS = 100
+
+
+class Log:
+    def __init__(self, size=SIZE, level=INFO, publish_level=WARN):
+        self.size = size
+        self.stamps = array('L', [0] * size)
+        self.levels = bytearray(size)
+        self.formats = [None] * size
+        self.args = [None] * size
+        self.head = 0
+        self.count = 0
+        self.dropped = 0
+        self.reported = 0
+        self.mask = 0
+        self.set_level(level)
+        self.publish = None
+        self.publish_level = publish_level
+
+    def set_level(self, level):
+        # Keep `level` and everything above it.
+        self.mask = (0xF << level) & 0xF
+
+    def enable(self, level, on=True):
+        if on:
+            self.mask |= 1 << level
+        else:
+            self.mask &= ~(1 << level)
+
+    def add(self, level, fmt, args):
+        if not self.mask & (1 << level):
+            return
+        if self.count == self.size:
+            self.head = (self.head + 1) % self.size
+            self.count -= 1
+            self.dropped += 1
+        i = (self.head + self.count) % self.size
+        self.stamps[i] = time.ticks_ms()
+        self.levels[i] = level
+        self.formats[i] = fmt
+        self.args[i] = args
+        self.count += 1
+
+    def debug(self, fmt, *args):
+        self.add(DEBUG, fmt, args)
+
+    def info(self, fmt, *args):
+        self.add(INFO, fmt, args)
+
+    def warn(self, fmt, *args):
+        self.add(WARN, fmt, args)
+
+    def error(self, fmt, *args):
+        self.add(ERROR, fmt, args)
+
+    def drain(self, limit=BATCH):
+        # Writes out up to `limit` records; returns how many were left.
+        while self.count and limit:
+            i = self.head
+            level = self.levels[i]
+            fmt = self.formats[i]
+            args = self.args[i]
+            text = fmt % args if args else fmt
+            self.formats[i] = None
+            self.args[i] = None
+            self.head = (i + 1) % self.size
+            self.count -= 1
+            limit -= 1
+            print("%d %s %s" % (self.stamps[i], LEVEL_NAMES[level], text))
+            if self.publish is not None and level >= self.publish_level:
+                self.publish(text.encode())
+        if self.dropped != self.reported:
+            print("log: %d records dropped" % (self.dropped - self.reported))
+            self.reported = self.dropped
+        return self.count
+
+    async def run(self, interval_ms=INTERVAL_MS):
+        while True:
+            await asyncio.sleep_ms(interval_ms)
+            if self.count:
+                self.drain()
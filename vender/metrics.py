@@ -0,0 +1,116 @@
+# ---- On-device Metrics ----
+# Counters and ticks_us() timing histograms for the hot paths. Histograms
+# have fixed bucket bounds (BOUNDS_US), so recording a sample is a short
+# loop over a tuple and an array increment; nothing grows at runtime.
+#
+#   metrics = Metrics()
+#   keypad.scan = metrics.timed("scan", keypad.scan)
+#   t = metrics.start(); ...; metrics.stop("check_msg", t)
+#   metrics.count("vends")
+#
+# report() packs everything into one line for the metrics topic:
+#   b"vends=3 empty=1 scan=120:40/90/310 ..."  (timers: n:p50/p99/max us)
+# and dump() prints it over serial, one metric per line.
+#
+# With enabled=False, timed() hands back the function unchanged and the
+# other calls return straight away, so instrumentation costs next to
+# nothing.
+
+from array import array
+import time
+
+ENABLED = True
+
+BOUNDS_US = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000,
+             100000, 250000, 1000000)
+
+
+class Histogram:
+    def __init__(self):
+        self.buckets = array('L', [0] * (len(BOUNDS_US) + 1))
+        self.n = 0
+        self.max = 0
+
+    def add(self, us):
+        i = 0
+        for bound in BOUNDS_US:
+            if us <= bound:
+                break
+            i += 1
+        self.buckets[i] += 1
+        self.n += 1
+        if us > self.max:
+            self.max = us
+
+    def percentile(self, pct):
+        # Upper bound of the bucket holding the pct-th sample, capped at
+        # the largest sample seen.
+        if not self.n:
+            return 0
+        target = (self.n * pct + 99) // 100
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if seen >= target:
+                return min(BOUNDS_US[i], self.max) if i < len(BOUNDS_US) else self.max
+        return self.max
+
+
+class Metrics:
+    def __init__(self, enabled=ENABLED):
+        self.enabled = enabled
+        self.counters = {}
+        self.timers = {}
+        self.gauges = {}
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name, read):
+        # read() is called when a report is made, e.g. a reconnect count.
+        self.gauges[name] = read
+
+    def start(self):
+        return time.ticks_us() if self.enabled else 0
+
+    def stop(self, name, started):
+        if not self.enabled:
+            return
+        self.record(name, time.ticks_diff(time.ticks_us(), started))
+
+    def record(self, name, us):
+        # A duration measured elsewhere (a GC pause, a PUBACK round trip).
+        if not self.enabled:
+            return
+        hist = self.timers.get(name)
+        if hist is None:
+            hist = self.timers[name] = Histogram()
+        hist.add(us)
+
+    def timed(self, name, fn):
+        if not self.enabled:
+            return fn
+
+        def wrapper(*args):
+            started = time.ticks_us()
+            result = fn(*args)
+            self.record(name, time.ticks_diff(time.ticks_us(), started))
+            return result
+        return wrapper
+
+    def items(self):
+        for name, value in self.counters.items():
+            yield name, b"%d" % value
+        for name, read in self.gauges.items():
+            yield name, b"%d" % read()
+        for name, hist in self.timers.items():
+            yield name, b"%d:%d/%d/%d" % (hist.n, hist.percentile(50),
+                                          hist.percentile(99), hist.max)
+
+    def report(self):
+        return b" ".join(name.encode() + b"=" + value for name, value in self.items())
+
+    def dump(self):
+        for name, value in self.items():
+            print("%-12s %s" % (name, value.decode()))
@@ -0,0 +1,89 @@
+# ---- Retained-mode OLED Text ----
+# Keeps the text on each row and, when a row changes, redraws only the
+# characters that differ. show() then sends just the changed columns of the
+# changed SSD1306 pages instead of the whole 1 KB framebuffer, so updating
+# "Count: 3" to "Count: 4" costs one character cell per page.
+
+SET_COL_ADDR = 0x21
+SET_PAGE_ADDR = 0x22
+
+CHAR_W = 8
+CHAR_H = 8
+
+
+class TextScreen:
+    def __init__(self, oled, rows):
+        # rows: y position of each text row, in pixels
+        self.oled = oled
+        self.rows = rows
+        self.text = [""] * len(rows)
+        self.pages = oled.height // 8
+        self.lo = bytearray(b"\xff" * self.pages)
+        self.hi = bytearray(self.pages)
+        self.buffer = memoryview(oled.buffer)
+        self.bytes_sent = 0
+
+    def _mark(self, y, x0, x1):
+        for page in range(y // 8, min((y + CHAR_H - 1) // 8 + 1, self.pages)):
+            if x0 < self.lo[page]:
+                self.lo[page] = x0
+            if x1 > self.hi[page]:
+                self.hi[page] = x1
+
+    def set(self, row, text):
+        old = self.text[row]
+        if text == old:
+            return False
+        # First and last character cell that differ.
+        n = max(len(old), len(text))
+        start = 0
+        while start < n and start < len(old) and start < len(text) and old[start] == text[start]:
+            start += 1
+        end = n
+        while end > start and end <= len(old) and end <= len(text) and old[end - 1] == text[end - 1]:
+            end -= 1
+        x0 = start * CHAR_W
+        x1 = min(end * CHAR_W, self.oled.width) - 1
+        if x0 > x1:
+            self.text[row] = text
+            return False
+        y = self.rows[row]
+        self.oled.fill_rect(x0, y, x1 - x0 + 1, CHAR_H, 0)
+        self.oled.text(text[start:end], x0, y, 1)
+        self.text[row] = text
+        self._mark(y, x0, x1)
+        return True
+
+    def invalidate(self):
+        for page in range(self.pages):
+            self.lo[page] = 0
+            self.hi[page] = self.oled.width - 1
+
+    def dirty(self):
+        for page in range(self.pages):
+            if self.lo[page] <= self.hi[page]:
+                return True
+        return False
+
+    def show(self):
+        oled = self.oled
+        width = oled.width
+        sent = 0
+        for page in range(self.pages):
+            x0 = self.lo[page]
+            x1 = self.hi[page]
+            if x0 > x1:
+                continue
+            oled.write_cmd(SET_COL_ADDR)
+            oled.write_cmd(x0)
+            oled.write_cmd(x1)
+            oled.write_cmd(SET_PAGE_ADDR)
+            oled.write_cmd(page)
+            oled.write_cmd(page)
+            start = page * width
+            oled.write_data(self.buffer[start + x0:start + x1 + 1])
+            sent += x1 - x0 + 1
+            self.lo[page] = 0xFF
+            self.hi[page] = 0
+        self.bytes_sent += sent
+        return sent
@@ -0,0 +1,221 @@
+# ---- Offline Outbox ----
+# Holds outgoing (topic, msg) pairs while the broker can't be reached. New
+# messages go into a fixed RAM ring; when the ring fills, its whole content
+# is appended to a spool file in one write and the ring starts over. Oldest
+# first is always the spool, then the ring. The spool survives a reset and
+# is picked up again at boot; a reset in the middle of a spill can leave a
+# torn last record, which is cut off then so new spills line up again.
+#
+# Draining is two-step so nothing is lost if the send fails: peek() returns
+# up to `limit` of the oldest messages and commit() drops them (or the
+# first n of them) once they have been written. ready() rate-limits
+# draining to one batch every `interval_ms`, so a reconnect after a long
+# outage doesn't monopolise the radio.
+#
+# Spool records: topic length (1 byte), message length (2 bytes), topic,
+# message.
+
+import os
+import struct
+import time
+
+
+class Outbox:
+    def __init__(self, path="outbox.spool", size=32, max_spool=16384,
+                 batch=20, interval_ms=100):
+        self.path = path
+        self.ring = [None] * size
+        self.head = 0
+        self.count = 0
+        self.max_spool = max_spool
+        self.batch = batch
+        self.interval_ms = interval_ms
+        self.spool_pos = 0
+        self.spool_size = 0
+        self.spool_count = 0
+        self.dropped = 0
+        self.last_drain = time.ticks_ms()
+        self._peeked_spool = 0
+        self._peeked_ring = 0
+        self._next_pos = 0
+        self._ends = []
+        try:
+            self.spool_size = os.stat(path)[6]
+        except OSError:
+            pass
+        if self.spool_size:
+            # Left over from before a reset.
+            self.spool_count, end = self._scan_spool()
+            if end < self.spool_size:
+                self._cut_spool(end)
+
+    def __len__(self):
+        return self.count + self.spool_count
+
+    def has_spool(self):
+        return self.spool_pos < self.spool_size
+
+    # ---- Queueing ----
+    def put(self, topic, msg):
+        if self.count == len(self.ring):
+            self.spill()
+            if self.count == len(self.ring):
+                self.dropped += 1
+                return False
+        self.ring[(self.head + self.count) % len(self.ring)] = (topic, msg)
+        self.count += 1
+        return True
+
+    def spill(self):
+        size = len(self.ring)
+        data = bytearray()
+        for i in range(self.count):
+            topic, msg = self.ring[(self.head + i) % size]
+            data += struct.pack("<BH", len(topic), len(msg))
+            data += topic
+            data += msg
+        if self.spool_size + len(data) > self.max_spool:
+            return
+        try:
+            with open(self.path, "ab") as f:
+                f.write(data)
+        except OSError:
+            return
+        self.spool_size += len(data)
+        self.spool_count += self.count
+        for i in range(size):
+            self.ring[i] = None
+        self.head = 0
+        self.count = 0
+
+    # ---- Draining ----
+    def ready(self):
+        if not len(self):
+            return False
+        return time.ticks_diff(time.ticks_ms(), self.last_drain) >= self.interval_ms
+
+    def peek(self, limit=None):
+        limit = limit or self.batch
+        out = []
+        self._peeked_spool = 0
+        del self._ends[:]
+        self._next_pos = self.spool_pos
+        if self.has_spool():
+            out, self._next_pos = self._read_spool(limit, self._ends)
+            self._peeked_spool = len(out)
+        size = len(self.ring)
+        i = 0
+        while len(out) < limit and i < self.count:
+            out.append(self.ring[(self.head + i) % size])
+            i += 1
+        self._peeked_ring = i
+        return out
+
+    def _read_spool(self, limit, ends=None):
+        # Up to `limit` records from spool_pos on and the position after
+        # them; `ends`, if given, gets the position after each record.
+        out = []
+        pos = self.spool_pos
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(pos)
+                while len(out) < limit and pos < self.spool_size:
+                    header = f.read(3)
+                    if len(header) < 3:
+                        break
+                    tlen, mlen = struct.unpack("<BH", header)
+                    topic = f.read(tlen)
+                    msg = f.read(mlen)
+                    if len(msg) < mlen:
+                        break
+                    out.append((topic, msg))
+                    pos += 3 + tlen + mlen
+                    if ends is not None:
+                        ends.append(pos)
+        except OSError:
+            pass
+        if pos == self.spool_pos and not out:
+            # Unreadable or truncated spool: give up on the rest of it.
+            pos = self.spool_size
+        return out, pos
+
+    def commit(self, n=None):
+        # Drop the first n (default: all) of what the last peek() returned.
+        self.last_drain = time.ticks_ms()
+        spool = self._peeked_spool
+        ring = self._peeked_ring
+        if n is not None and n < spool + ring:
+            if n < spool:
+                spool = n
+                ring = 0
+            else:
+                ring = n - spool
+        if spool < self._peeked_spool:
+            if spool:
+                self.spool_pos = self._ends[spool - 1]
+        else:
+            # Also skips what peek() couldn't read.
+            self.spool_pos = self._next_pos
+        self.spool_count -= spool
+        if self.spool_size and not self.has_spool():
+            self._remove_spool()
+        size = len(self.ring)
+        for _ in range(ring):
+            self.ring[self.head] = None
+            self.head = (self.head + 1) % size
+            self.count -= 1
+        self._peeked_spool = 0
+        self._peeked_ring = 0
+
+    def _scan_spool(self):
+        # Number of complete records in the spool and where the last one
+        # ends.
+        count = 0
+        pos = 0
+        try:
+            with open(self.path, "rb") as f:
+                while True:
+                    header = f.read(3)
+                    if len(header) < 3:
+                        break
+                    tlen, mlen = struct.unpack("<BH", header)
+                    end = pos + 3 + tlen + mlen
+                    if end > self.spool_size:
+                        break
+                    f.seek(end)
+                    pos = end
+                    count += 1
+        except OSError:
+            pass
+        return count, pos
+
+    def _cut_spool(self, end):
+        # Keeps spool[:end]; the spool is dropped if that fails.
+        if end:
+            tmp = self.path + ".tmp"
+            try:
+                with open(self.path, "rb") as src, open(tmp, "wb") as dst:
+                    left = end
+                    while left:
+                        chunk = src.read(min(left, 512))
+                        if not chunk:
+                            break
+                        dst.write(chunk)
+                        left -= len(chunk)
+                if not left:
+                    os.remove(self.path)
+                    os.rename(tmp, self.path)
+                    self.spool_size = end
+                    return
+            except OSError:
+                pass
+        self._remove_spool()
+
+    def _remove_spool(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+        self.spool_pos = 0
+        self.spool_size = 0
+        self.spool_count = 0
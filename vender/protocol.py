@@ -0,0 +1,92 @@
+# ---- Remote Command Protocol ----
+# Commands arrive on <root>command (or a slot's own command topic) as one
+# line of space-separated words: a correlation id chosen by the sender,
+# the command, then its arguments. Slots are numbered from 1.
+#
+#   17 vend 2          vend from slot 2
+#   18 vend 1 1 2      batch: two from slot 1, then one from slot 2
+#   19 load 1 3        load three snacks into slot 1
+#   20 status          counts and capacities of every slot
+#   21 set_capacity 1 8
+#   24 metrics         counters and timings, as published on <root>metrics
+#   25 log 2           log level for serial: 0 debug .. 3 error, 4 off
+#
+# On a slot's command topic that slot is implied for vend (with no slots
+# given), load and set_capacity: "22 vend", "23 load 3". The bare payload
+# b"vend" still works there as before, without a reply.
+#
+# Every command gets a reply on <root>reply that starts with its id:
+#
+#   17 ack             vend accepted and queued
+#   17 ok 4            vend done; 4 left in that slot
+#   18 err 3 2 empty   batch result, one word per item; err if any failed
+#   19 ok 5            load: count afterwards (err full if it didn't fit)
+#   20 ok 2/5 0/5      status: count/capacity per slot
+#   21 err args        bad or missing arguments (also: slot, unknown)
+#   22 err busy 8      vend queue full (8 waiting); try again later
+#
+# Vends are acknowledged as soon as they are queued and answered again
+# when the arm is back, so the backend can pipeline commands and time both.
+# Ids must be unique per machine: a repeated id within a minute is not run
+# again but answered with the latest reply (see dedupe.py). Bare b"vend"
+# payloads have no id and can't be deduplicated.
+
+VEND = b"vend"
+LOAD = b"load"
+STATUS = b"status"
+SET_CAPACITY = b"set_capacity"
+METRICS = b"metrics"
+LOG = b"log"
+
+ACK = b"ack"
+OK = b"ok"
+ERR = b"err"
+
+EMPTY = b"empty"
+FULL = b"full"
+BAD_ARGS = b"args"
+BAD_SLOT = b"slot"
+UNKNOWN = b"unknown"
+BUSY = b"busy"
+
+# States published on <root>queue
+READY = b"ready"
+
+
+def parse(msg):
+    # (id, command, [int args]) or None if there is no id and command;
+    # args is None when an argument isn't a number.
+    parts = msg.split()
+    if len(parts) < 2:
+        return None
+    try:
+        args = [int(a) for a in parts[2:]]
+    except ValueError:
+        args = None
+    return parts[0], parts[1], args
+
+
+def reply(cid, status, values=()):
+    out = cid + b" " + status
+    for value in values:
+        if isinstance(value, int):
+            value = b"%d" % value
+        out += b" " + value
+    return out
+
+
+class Request:
+    # A command whose answer depends on vends that haven't finished yet.
+    def __init__(self, cid, items):
+        self.cid = cid
+        self.left = items
+        self.ok = True
+        self.results = []
+
+    def done(self, value, ok=True):
+        # Records one item's result; True once every item has reported.
+        self.results.append(value)
+        if not ok:
+            self.ok = False
+        self.left -= 1
+        return self.left == 0
@@ -0,0 +1,280 @@
+# ---- Outbound Publish Queue ----
+# Everything the firmware wants to say over MQTT goes through here instead of
+# straight to mqtt_client.publish(). Events (vend_start, vend_attempt_empty)
+# are queued in order. Status updates are coalesced per topic: the latest
+# count wins and so does the latest state word (loaded / empty /
+# load_snack). flush(), called once per loop tick, packs every queued
+# message as an MQTT PUBLISH packet into one preallocated buffer and hands
+# it to the socket in a single write.
+#
+# Given an Outbox, nothing is lost while offline: messages that can't be
+# sent (no client, or the socket write failed) are parked there, anything
+# new queues up behind the backlog, and each flush drains one rate-limited
+# batch from it once the connection is back. A failed write calls
+# on_error(), if set, so whoever owns the connection can reconnect.
+#
+# With COMBINED set, each slot's status goes out as one payload such as
+# b"count:3,loaded" instead of b"count:3" followed by b"loaded".
+# The b"count:<n>" payloads are made once per count and reused, and a
+# topic's status entry is updated in place, so a status change costs no
+# new objects once each count has been seen.
+#
+# Given a wire.Encoder as `wire`, slot status and events are sent in the
+# binary format instead, all of one flush in a single payload on
+# <root>wire; anything the encoder has no code for stays text.
+#
+# Given a qos.Sender as `qos`, the messages it wants go out QoS 1 through
+# its in-flight window instead (see qos.py), in their place among the rest;
+# flush() also runs whenever the sender has a retransmit due. While the
+# window is full, the first QoS 1 message and everything after it wait (in
+# the outbox, or at the front of the queue) for a later flush.
+
+COMBINED = False
+
+
+class Publisher:
+    def __init__(self, size=512, combined=COMBINED, outbox=None, wire=None, qos=None):
+        self.client = None
+        self.outbox = outbox
+        self.on_error = None
+        self.combined = combined
+        self.wire = wire
+        self.qos = qos
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        self.events = []
+        self.status = {}
+        self.order = []
+        self.counts = {}
+        self.published = 0
+        self.coalesced = 0
+        self.writes = 0
+        # Progress of the current _write(): messages packed, and how many
+        # of those are on the socket.
+        self.packed = 0
+        self.written = 0
+
+    def event(self, topic, msg):
+        self.events.append((topic, msg))
+
+    def set_status(self, topic, count, state=None):
+        # Entries are [count, state, queued] and live as long as the topic.
+        entry = self.status.get(topic)
+        if entry is None:
+            entry = self.status[topic] = [0, None, False]
+        if entry[2]:
+            self.coalesced += 1
+            if state is None:
+                state = entry[1]
+        else:
+            entry[2] = True
+            self.order.append(topic)
+        entry[0] = count
+        entry[1] = state
+
+    def count_msg(self, count):
+        msg = self.counts.get(count)
+        if msg is None:
+            msg = self.counts[count] = b"count:%d" % count
+        return msg
+
+    def pending(self):
+        return len(self.events) + len(self.order)
+
+    def messages(self):
+        if self.wire is not None:
+            return self._wire_messages()
+        out = self.events
+        for topic in self.order:
+            entry = self.status[topic]
+            entry[2] = False
+            self._status_text(out, topic, entry[0], entry[1])
+        self.events = []
+        self.order = []
+        return out
+
+    def _status_text(self, out, topic, count, state):
+        if self.combined:
+            msg = self.count_msg(count)
+            if state:
+                msg += b"," + state
+            out.append((topic, msg))
+        else:
+            out.append((topic, self.count_msg(count)))
+            if state:
+                out.append((topic, state))
+
+    def _wire_messages(self):
+        wire = self.wire
+        out = []
+        for topic, msg in self.events:
+            if not wire.event(topic, msg):
+                out.append((topic, msg))
+            elif wire.full():
+                out.append(wire.take())
+        for topic in self.order:
+            entry = self.status[topic]
+            entry[2] = False
+            if not wire.status(topic, entry[0], entry[1]):
+                self._status_text(out, topic, entry[0], entry[1])
+            elif wire.full():
+                out.append(wire.take())
+        if wire.n:
+            out.append(wire.take())
+        self.events = []
+        self.order = []
+        return out
+
+    def pack(self, pos, topic, msg, pid=0, dup=False):
+        # PUBLISH packet at buf[pos:], QoS 1 with packet id `pid` if given,
+        # else QoS 0; returns the new end, or -1 if it doesn't fit.
+        buf = self.buf
+        sz = 2 + len(topic) + len(msg)
+        if pid:
+            sz += 2
+        end = pos + 1 + (1 if sz < 128 else 2) + sz
+        if sz >= 16384 or end > len(buf):
+            return -1
+        buf[pos] = 0x30 | (0x02 if pid else 0) | (0x08 if dup else 0)
+        pos += 1
+        if sz >= 128:
+            buf[pos] = (sz & 0x7F) | 0x80
+            pos += 1
+            sz >>= 7
+        buf[pos] = sz
+        buf[pos + 1] = len(topic) >> 8
+        buf[pos + 2] = len(topic) & 0xFF
+        pos += 3
+        buf[pos:pos + len(topic)] = topic
+        pos += len(topic)
+        if pid:
+            buf[pos] = pid >> 8
+            buf[pos + 1] = pid & 0xFF
+            pos += 2
+        buf[pos:pos + len(msg)] = msg
+        return pos + len(msg)
+
+    def _qos1(self, topic, msg):
+        # Whether the QoS 1 sender takes this message; anything that
+        # wouldn't fit the buffer in one piece stays QoS 0.
+        qos = self.qos
+        return (qos is not None and qos.wants(topic)
+                and len(topic) + len(msg) + 8 <= len(self.buf))
+
+    def _qos_due(self):
+        return self.qos is not None and self.client is not None and self.qos.due()
+
+    def flush(self):
+        outbox = self.outbox
+        if outbox is None:
+            return self._flush_direct()
+        if not self.pending() and not len(outbox) and not self._qos_due():
+            return 0
+        messages = self.messages()
+        client = self.client
+        if client is None or len(outbox):
+            # Offline, or a backlog to keep in order: queue behind it.
+            for topic, msg in messages:
+                outbox.put(topic, msg)
+            if client is None or not outbox.ready():
+                return 0
+            messages = outbox.peek()
+            try:
+                n = self._write(client, messages)
+            except OSError:
+                outbox.commit(self.written)
+                self._failed()
+                return 0
+            outbox.commit(n)
+        else:
+            try:
+                n = self._write(client, messages)
+            except OSError:
+                for topic, msg in self._unsent(messages):
+                    outbox.put(topic, msg)
+                self._failed()
+                return 0
+            # Whatever the QoS 1 window had no room for starts the backlog.
+            for i in range(n, len(messages)):
+                outbox.put(*messages[i])
+        self.published += n
+        return n
+
+    def _failed(self):
+        if self.on_error:
+            self.on_error()
+
+    def _flush_direct(self):
+        if not self.pending() and not self._qos_due():
+            return 0
+        messages = self.messages()
+        client = self.client
+        if client is None:
+            return 0
+        try:
+            n = self._write(client, messages)
+        except OSError:
+            # The socket broke mid-batch: keep what didn't go out for the
+            # next flush, once the client has reconnected.
+            self.events = self._unsent(messages) + self.events
+            self._failed()
+            return 0
+        if n < len(messages):
+            self.events = messages[n:] + self.events
+        self.published += n
+        return n
+
+    def _write(self, client, messages):
+        # Sends messages in order until the first QoS 1 one the window has
+        # no room for; returns how many went. If the socket fails, the
+        # first self.written of them went out before it did.
+        self.packed = 0
+        self.written = 0
+        qos = self.qos
+        pos = 0
+        if qos is not None:
+            pos = qos.retransmit(self, client, pos)
+        n = 0
+        for topic, msg in messages:
+            if self._qos1(topic, msg):
+                if not qos.free():
+                    break
+                pos = qos.start(self, client, pos, topic, msg)
+            else:
+                pos = self.emit(client, pos, topic, msg)
+            n += 1
+            self.packed = n
+            if not pos:
+                # Too big for the buffer, emit() published it by itself.
+                self.written = n
+        if pos:
+            self._send(client, pos)
+        return n
+
+    def _unsent(self, messages):
+        # What a failed _write() didn't get out, leaving the QoS 1 messages
+        # the sender has taken to its retransmits.
+        out = []
+        for i in range(self.written, len(messages)):
+            topic, msg = messages[i]
+            if i >= self.packed or not self._qos1(topic, msg):
+                out.append((topic, msg))
+        return out
+
+    def _send(self, client, pos):
+        client.sock.write(self.view[:pos])
+        self.writes += 1
+        self.written = self.packed
+
+    def emit(self, client, pos, topic, msg, pid=0, dup=False):
+        # Packs one PUBLISH after buf[:pos], writing out what is there
+        # first if it doesn't fit; returns the new end.
+        end = self.pack(pos, topic, msg, pid, dup)
+        if end < 0:
+            if pos:
+                self._send(client, pos)
+            end = self.pack(0, topic, msg, pid, dup)
+            if end < 0:
+                client.publish(topic, msg)
+                return 0
+        return end
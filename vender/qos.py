@@ -0,0 +1,125 @@
+# ---- QoS 1 Sender ----
+# At-least-once delivery for the messages that matter (vend events, command
+# replies) without waiting on the broker: umqtt.simple's publish(qos=1)
+# blocks until its PUBACK, this keeps up to `window` PUBLISHes in flight
+# at once, each with its own packet id, and goes on with the next tick.
+#
+# The publisher sends every message wants(topic) picks through start(),
+# in its place in the batch, as long as free() says the window has room;
+# otherwise the message and everything after it wait where they are (the
+# outbox, or the publisher's queue), so nothing is dropped or reordered.
+# retransmit() sends anything unacknowledged for retry_ms again with the
+# DUP flag; check_msg() wraps client.check_msg() and matches the PUBACKs
+# umqtt.simple leaves for the caller. After a reconnect resend() makes
+# everything in flight go again. Duplicates are possible (that is QoS 1),
+# so consumers dedupe on the command id or wire sequence number.
+
+from array import array
+import time
+
+PUBACK = 0x40
+
+WINDOW = 8
+RETRY_MS = 2000
+MAX_PACKETS = 8
+
+
+class Sender:
+    def __init__(self, wants=None, window=WINDOW, retry_ms=RETRY_MS, metrics=None):
+        self.wants = wants
+        self.window = window
+        self.retry_ms = retry_ms
+        self.metrics = metrics
+        # In flight, by window slot; pid 0 marks a free slot.
+        self.pids = array('H', [0] * window)
+        self.stamps = array('L', [0] * window)
+        self.started = array('L', [0] * window)
+        self.topics = [None] * window
+        self.msgs = [None] * window
+        self.used = 0
+        self.pid = 0
+        # Metrics
+        self.sent = 0
+        self.acked = 0
+        self.retries = 0
+
+    def free(self):
+        return self.used < self.window
+
+    def _next_pid(self):
+        self.pid = self.pid % 0xFFFF + 1
+        return self.pid
+
+    def due(self):
+        # Whether anything in flight is due for a retransmit.
+        if self.used:
+            now = time.ticks_ms()
+            for i in range(self.window):
+                if self.pids[i] and time.ticks_diff(now, self.stamps[i]) >= self.retry_ms:
+                    return True
+        return False
+
+    def retransmit(self, publisher, client, pos):
+        # Packs what is due again after buf[:pos] of the publisher;
+        # returns the new end.
+        if not self.used:
+            return pos
+        now = time.ticks_ms()
+        pids = self.pids
+        for i in range(self.window):
+            if pids[i] and time.ticks_diff(now, self.stamps[i]) >= self.retry_ms:
+                pos = publisher.emit(client, pos, self.topics[i], self.msgs[i], pids[i], True)
+                self.stamps[i] = now
+                self.retries += 1
+        return pos
+
+    def start(self, publisher, client, pos, topic, msg):
+        # Takes a free window slot (check free() first) and packs the
+        # PUBLISH after buf[:pos]; returns the new end.
+        pids = self.pids
+        i = 0
+        while pids[i]:
+            i += 1
+        now = time.ticks_ms()
+        pids[i] = self._next_pid()
+        self.topics[i] = topic
+        self.msgs[i] = msg
+        self.stamps[i] = now
+        self.started[i] = now
+        self.used += 1
+        self.sent += 1
+        return publisher.emit(client, pos, topic, msg, pids[i])
+
+    def ack(self, pid):
+        pids = self.pids
+        for i in range(self.window):
+            if pids[i] == pid:
+                pids[i] = 0
+                self.topics[i] = None
+                self.msgs[i] = None
+                self.used -= 1
+                self.acked += 1
+                if self.metrics is not None:
+                    self.metrics.record("puback", time.ticks_diff(time.ticks_ms(), self.started[i]) * 1000)
+                return True
+        return False
+
+    def resend(self):
+        # New connection: everything in flight is due now.
+        now = time.ticks_ms()
+        for i in range(self.window):
+            if self.pids[i]:
+                self.stamps[i] = time.ticks_add(now, -self.retry_ms)
+
+    def check_msg(self, client, limit=MAX_PACKETS):
+        # client.check_msg() until nothing is waiting (at most `limit`
+        # packets), reading the PUBACKs it returns unread.
+        for _ in range(limit):
+            op = client.check_msg()
+            if op != PUBACK:
+                return op
+            sock = client.sock
+            sock.read(1)
+            pid = sock.read(2)
+            self.ack(pid[0] << 8 | pid[1])
+        return None
@@ -0,0 +1,125 @@
+# ---- Servo Motion Controller ----
+# Runs a move as a list of (angle, dwell_ms) steps without blocking: each
+# step sets the angle, then a one-shot hardware Timer (or a caller polling
+# update()) moves on to the next step once the dwell has passed. on_done is
+# called when the last step finishes. With a Timer it runs in the timer
+# callback, so it should only set a flag.
+#
+# Each servo has a calibration Profile: its duty range and the home and
+# vend angles and dwell times of its slot. DutyTable turns the duty range
+# into integer duties for every whole degree once, at start-up, after
+# finding out which PWM call the port has, so moving the arm is one table
+# lookup and one PWM write.
+
+from array import array
+import time
+
+MAX_ANGLE = 180
+
+
+class Profile:
+    # Duties are in 10-bit PWM.duty() units at 50 Hz (25 = 0.5 ms,
+    # 125 = 2.4 ms).
+    def __init__(self, min_duty=25, max_duty=125, home_angle=0, vend_angle=180,
+                 vend_ms=800, return_ms=400):
+        self.min_duty = min_duty
+        self.max_duty = max_duty
+        self.home_angle = min(max(home_angle, 0), MAX_ANGLE)
+        self.vend_angle = min(max(vend_angle, 0), MAX_ANGLE)
+        self.vend_ms = vend_ms
+        self.return_ms = return_ms
+
+
+def duty_writer(pwm):
+    # (write, scale): ESP32 ports have the 10-bit duty(); others only have
+    # duty_u16(), which takes 64 times the value.
+    if hasattr(pwm, "duty"):
+        return pwm.duty, 1
+    return pwm.duty_u16, 64
+
+
+class DutyTable:
+    def __init__(self, pwm, profile):
+        self.write, scale = duty_writer(pwm)
+        low = profile.min_duty
+        span = profile.max_duty - low
+        self.table = array('H', [(low + (a * span + MAX_ANGLE // 2) // MAX_ANGLE) * scale
+                                 for a in range(MAX_ANGLE + 1)])
+
+    def set_angle(self, angle):
+        self.write(self.table[angle])
+
+
+class ServoMotion:
+    def __init__(self, set_angle, home_angle=0, timer=None, profile=None):
+        self.set_angle = set_angle
+        self.profile = profile
+        if profile is not None:
+            home_angle = profile.home_angle
+        self.home_angle = home_angle
+        self.timer = timer
+        self.steps = ()
+        self.profile_steps = None
+        self.index = 0
+        self.due = 0
+        self.on_done = None
+        self.busy = False
+
+    def start(self, steps, on_done=None):
+        if self.busy:
+            return False
+        self.steps = steps
+        self.index = 0
+        self.on_done = on_done
+        self.busy = True
+        self._step()
+        return True
+
+    def vend(self, vend_angle, dwell_ms, return_ms, on_done=None):
+        return self.start(((vend_angle, dwell_ms), (self.home_angle, return_ms)), on_done)
+
+    def dispense(self, on_done=None):
+        # One vend stroke as calibrated in the profile. The steps tuple is
+        # built once and reused.
+        steps = self.profile_steps
+        if steps is None:
+            p = self.profile
+            steps = self.profile_steps = ((p.vend_angle, p.vend_ms),
+                                          (self.home_angle, p.return_ms))
+        return self.start(steps, on_done)
+
+    def _step(self):
+        angle, dwell_ms = self.steps[self.index]
+        self.set_angle(angle)
+        self.due = time.ticks_add(time.ticks_ms(), dwell_ms)
+        if self.timer is not None:
+            self.timer.init(mode=self.timer.ONE_SHOT, period=dwell_ms, callback=self._on_timer)
+
+    def _on_timer(self, timer):
+        left = self.remaining_ms()
+        if left:
+            timer.init(mode=timer.ONE_SHOT, period=left, callback=self._on_timer)
+        else:
+            self.update()
+
+    def stop(self):
+        if self.timer is not None:
+            self.timer.deinit()
+        self.busy = False
+        self.set_angle(self.home_angle)
+
+    def remaining_ms(self):
+        if not self.busy:
+            return 0
+        return max(0, time.ticks_diff(self.due, time.ticks_ms()))
+
+    def update(self):
+        if not self.busy or self.remaining_ms():
+            return
+        self.index += 1
+        if self.index < len(self.steps):
+            self._step()
+            return
+        self.busy = False
+        if self.on_done:
+            self.on_done()
@@ -0,0 +1,33 @@
+# ---- Boot Profile ----
+# Records when each startup stage finishes, in ms since reset (ticks_ms()
+# starts at zero when the board boots), and prints it as it goes:
+#
+#   boot: drivers        112 ms
+#   boot: ready          115 ms
+#   boot: display        161 ms
+#   boot: mqtt          3254 ms
+#   boot: first_vend    5120 ms
+#
+# Only the first time a stage is reached counts.
+
+import time
+
+
+class BootProfile:
+    def __init__(self):
+        self.stages = []
+        self.seen = set()
+
+    def mark(self, name):
+        if name in self.seen:
+            return
+        at = time.ticks_ms()
+        self.seen.add(name)
+        self.stages.append((name, at))
+        print("boot: %-12s %6d ms" % (name, at))
+
+    def elapsed(self, name):
+        for stage, at in self.stages:
+            if stage == name:
+                return at
+        return -1
@@ -0,0 +1,158 @@
+# ---- Connection Supervisor ----
+# A background task that keeps Wi-Fi and MQTT up. It checks the link every
+# CHECK_MS; when Wi-Fi is down it rejoins without blocking (polling
+# isconnected() between awaits, and giving up as soon as status() says the
+# attempt failed), then builds a fresh MQTT client with `connect_mqtt()`,
+# which should put a timeout on its socket: it runs synchronously. Failed
+# attempts back off exponentially from BASE_MS to MAX_MS with jitter, so a
+# fleet that lost the same access point doesn't reconnect in lockstep.
+# Anything that notices a dead socket calls lost() to wake it straight
+# away.
+#
+# on_online(client) and on_offline() tell the rest of the firmware which
+# client to use. Progress goes to `log` (a private Log if None).
+
+import random
+import time
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+from vender.log import Log
+
+try:
+    from network import STAT_CONNECTING, STAT_GOT_IP
+except ImportError:
+    # The ESP32 port's values.
+    STAT_CONNECTING = 1001
+    STAT_GOT_IP = 1010
+
+OFFLINE = 0
+WIFI = 1
+MQTT = 2
+ONLINE = 3
+
+STATE_NAMES = ("offline", "wifi", "mqtt", "online")
+
+CHECK_MS = 1000
+POLL_MS = 100
+WIFI_TIMEOUT_MS = 15000
+BASE_MS = 500
+MAX_MS = 60000
+PING_MS = 30000
+
+
+class Supervisor:
+    def __init__(self, wlan, ssid, password, connect_mqtt, on_online=None, on_offline=None,
+                 log=None):
+        self.wlan = wlan
+        self.log = log if log is not None else Log()
+        self.ssid = ssid
+        self.password = password
+        self.connect_mqtt = connect_mqtt
+        self.on_online = on_online
+        self.on_offline = on_offline
+        self.client = None
+        self.state = OFFLINE
+        self.failures = 0
+        self.wifi_connects = 0
+        self.mqtt_connects = 0
+        self.last_ping = 0
+        self.wake = asyncio.Event()
+
+    def backoff_ms(self):
+        delay = BASE_MS << min(self.failures, 16)
+        if delay > MAX_MS:
+            delay = MAX_MS
+        # Half fixed, half random.
+        half = delay // 2
+        return half + (random.getrandbits(16) * half >> 16)
+
+    def lost(self):
+        if self.client is not None:
+            self._drop()
+        self.wake.set()
+
+    def _drop(self):
+        client = self.client
+        self.client = None
+        self.state = OFFLINE
+        try:
+            client.sock.close()
+        except Exception:
+            pass
+        if self.on_offline:
+            self.on_offline()
+
+    async def _sleep(self, ms):
+        # Sleep, but wake early if someone reports the link lost.
+        self.wake.clear()
+        try:
+            await asyncio.wait_for_ms(self.wake.wait(), ms)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _join_wifi(self):
+        self.state = WIFI
+        self.wifi_connects += 1
+        wlan = self.wlan
+        wlan.active(True)
+        try:
+            wlan.disconnect()
+            wlan.connect(self.ssid, self.password)
+        except OSError:
+            return False
+        start = time.ticks_ms()
+        while not wlan.isconnected():
+            status = wlan.status()
+            if status != STAT_CONNECTING and status != STAT_GOT_IP:
+                # Wrong password, no access point, or the attempt ended.
+                self.log.warn("WiFi join failed: status %d", status)
+                return False
+            if time.ticks_diff(time.ticks_ms(), start) > WIFI_TIMEOUT_MS:
+                return False
+            await asyncio.sleep_ms(POLL_MS)
+        self.log.info("WiFi Connected: %s", wlan.ifconfig())
+        return True
+
+    def _join_mqtt(self):
+        self.state = MQTT
+        self.mqtt_connects += 1
+        try:
+            client = self.connect_mqtt()
+        except Exception as e:
+            self.log.warn("MQTT connect failed: %s", e)
+            return False
+        self.client = client
+        self.state = ONLINE
+        self.last_ping = time.ticks_ms()
+        if self.on_online:
+            self.on_online(client)
+        return True
+
+    async def run(self):
+        while True:
+            if not self.wlan.isconnected():
+                if self.client is not None:
+                    self._drop()
+                if not await self._join_wifi():
+                    self.state = OFFLINE
+                    self.failures += 1
+                    await self._sleep(self.backoff_ms())
+                    continue
+            if self.client is None:
+                if not self._join_mqtt():
+                    self.failures += 1
+                    await self._sleep(self.backoff_ms())
+                    continue
+            self.failures = 0
+            if time.ticks_diff(time.ticks_ms(), self.last_ping) >= PING_MS:
+                self.last_ping = time.ticks_ms()
+                try:
+                    self.client.ping()
+                except OSError:
+                    self._drop()
+                    continue
+            await self._sleep(CHECK_MS)
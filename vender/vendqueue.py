@@ -0,0 +1,82 @@
+# ---- Vend Queue ----
+# Vend requests wait here for the one servo executor. Customers at the
+# keypad and remote commands get separate fixed-size rings, so a burst of
+# remote commands can never lock out the person standing at the machine
+# and a busy keypad can't starve the backend: local requests go first, but
+# after LOCAL_BURST local vends in a row a waiting remote one is served.
+# put() refuses a request when its ring is full, which the caller turns
+# into back-pressure (an err busy reply, a "busy" queue state).
+
+LOCAL = 0
+REMOTE = 1
+
+LOCAL_SIZE = 4
+REMOTE_SIZE = 8
+LOCAL_BURST = 2
+
+
+class _Ring:
+    def __init__(self, size):
+        self.size = size
+        self.slots = bytearray(size)
+        self.requests = [None] * size
+        self.head = 0
+        self.count = 0
+
+    def put(self, slot, request):
+        i = (self.head + self.count) % self.size
+        self.slots[i] = slot
+        self.requests[i] = request
+        self.count += 1
+
+    def get(self):
+        i = self.head
+        request = self.requests[i]
+        self.requests[i] = None
+        self.head = (i + 1) % self.size
+        self.count -= 1
+        return self.slots[i], request
+
+
+class VendQueue:
+    def __init__(self, local_size=LOCAL_SIZE, remote_size=REMOTE_SIZE, burst=LOCAL_BURST):
+        self.rings = (_Ring(local_size), _Ring(remote_size))
+        self.burst = burst
+        self.streak = 0
+        # Metrics
+        self.max_depth = 0
+        self.accepted = [0, 0]
+        self.rejected = [0, 0]
+
+    def __len__(self):
+        return self.rings[LOCAL].count + self.rings[REMOTE].count
+
+    def depth(self, source):
+        return self.rings[source].count
+
+    def space(self, source):
+        ring = self.rings[source]
+        return ring.size - ring.count
+
+    def put(self, slot, request=None, source=LOCAL):
+        ring = self.rings[source]
+        if ring.count >= ring.size:
+            self.rejected[source] += 1
+            return False
+        ring.put(slot, request)
+        self.accepted[source] += 1
+        depth = len(self)
+        if depth > self.max_depth:
+            self.max_depth = depth
+        return True
+
+    def get(self):
+        # (slot, request) of the next vend, or None when both rings are empty.
+        local, remote = self.rings
+        if local.count and (not remote.count or self.streak < self.burst):
+            self.streak += 1
+            return local.get()
+        self.streak = 0
+        if remote.count:
+            return remote.get()
+        return None
@@ -0,0 +1,146 @@
+# ---- Binary Telemetry ----
+# Optional compact encoding for the status and event messages that normally
+# go out as text (b"count:3" and b"loaded" on <root>slot1/status,
+# b"vend_start" on <root>slot1/event). With an Encoder attached to the
+# publisher, every status and event from one flush is packed into a single
+# payload on <root>wire:
+#
+#   header  version (1 byte), record count (1 byte)
+#   record  code (1), slot (1), count (2), sequence (2), ticks_ms (4)
+#
+# little-endian, 10 bytes a record. Slot is 0-based, MACHINE for the
+# machine-wide queue state. The sequence number counts every record since
+# boot (wrapping at 65536), so the backend can spot gaps. Records are
+# packed with struct.pack_into() straight into one preallocated buffer;
+# the only allocation per flush is the finished payload.
+#
+# Replies, metrics and log lines stay text on their own topics. decode()
+# and text() are for the host side (backend, bridge, sim) and run on
+# plain CPython.
+
+import struct
+import time
+
+VERSION = 1
+
+HEADER_FMT = "<BB"
+RECORD_FMT = "<BBHHI"
+HEADER = struct.calcsize(HEADER_FMT)
+RECORD = struct.calcsize(RECORD_FMT)
+MAX_RECORDS = 24
+
+MACHINE = 0xFF
+
+# Codes: a status record carries the slot count, optionally with the state
+# word that went with it; events carry the slot count when they are sent.
+STATUS = 0
+LOADED = 1
+EMPTY = 2
+LOAD_SNACK = 3
+BUSY = 4
+READY = 5
+VEND_START = 16
+VEND_ATTEMPT_EMPTY = 17
+
+STATES = {
+    b"loaded": LOADED,
+    b"empty": EMPTY,
+    b"load_snack": LOAD_SNACK,
+    b"busy": BUSY,
+    b"ready": READY,
+}
+EVENTS = {
+    b"vend_start": VEND_START,
+    b"vend_attempt_empty": VEND_ATTEMPT_EMPTY,
+}
+NAMES = {STATUS: b"status"}
+for _word, _code in STATES.items():
+    NAMES[_code] = _word
+for _word, _code in EVENTS.items():
+    NAMES[_code] = _word
+del _word, _code
+
+
+class Encoder:
+    def __init__(self, inventory, max_records=MAX_RECORDS):
+        self.inventory = inventory
+        self.max_records = max_records
+        self.buf = bytearray(HEADER + max_records * RECORD)
+        self.view = memoryview(self.buf)
+        self.n = 0
+        self.seq = 0
+        self.records = 0
+
+    def full(self):
+        return self.n >= self.max_records
+
+    def add(self, code, slot, count):
+        struct.pack_into(RECORD_FMT, self.buf, HEADER + self.n * RECORD,
+                         code, slot, count, self.seq, time.ticks_ms() & 0xFFFFFFFF)
+        self.seq = (self.seq + 1) & 0xFFFF
+        self.n += 1
+        self.records += 1
+
+    def event(self, topic, msg):
+        # Packs a slot event; False if it isn't one we have a code for.
+        code = EVENTS.get(msg)
+        if code is None:
+            return False
+        slot = self.inventory.report_slots.get(topic, -1)
+        if slot < 0:
+            return False
+        self.add(code, slot, self.inventory.count(slot))
+        return True
+
+    def status(self, topic, count, state=None):
+        inv = self.inventory
+        if topic == inv.queue_topic:
+            slot = MACHINE
+        else:
+            slot = inv.report_slots.get(topic, -1)
+            if slot < 0:
+                return False
+        if state is None:
+            code = STATUS
+        else:
+            code = STATES.get(state)
+            if code is None:
+                return False
+        self.add(code, slot, count)
+        return True
+
+    def take(self):
+        # (topic, payload) for everything packed so far; starts a new one.
+        struct.pack_into(HEADER_FMT, self.buf, 0, VERSION, self.n)
+        payload = bytes(self.view[:HEADER + self.n * RECORD])
+        self.n = 0
+        return self.inventory.wire_topic, payload
+
+
+def decode(payload):
+    # [(code, slot, count, seq, ticks_ms), ...]; ValueError if malformed.
+    if len(payload) < HEADER:
+        raise ValueError("short payload")
+    version, n = struct.unpack_from(HEADER_FMT, payload, 0)
+    if version != VERSION:
+        raise ValueError("unknown version %d" % version)
+    if len(payload) != HEADER + n * RECORD:
+        raise ValueError("expected %d records, got %d bytes" % (n, len(payload)))
+    return [struct.unpack_from(RECORD_FMT, payload, HEADER + i * RECORD) for i in range(n)]
+
+
+def text(root, record):
+    # The (topic, msg) pairs the text encoding would have sent for a record,
+    # for bridging to consumers that still expect it.
+    code, slot, count, seq, stamp = record
+    if slot == MACHINE:
+        topic = root + b"queue"
+    else:
+        base = root + b"slot%d/" % (slot + 1)
+        if code in (VEND_START, VEND_ATTEMPT_EMPTY):
+            return [(base + b"event", NAMES[code])]
+        topic = base + b"status"
+    out = [(topic, b"count:%d" % count)]
+    if code != STATUS:
+        out.append((topic, NAMES[code]))
+    return out